@@ -0,0 +1,315 @@
+""" Benchmarks of the MASS simulator.
+
+Times stepping, with the encounter metrics used every step, against the
+number of vessels and the episode length, the encounter metrics with and
+without the grid search, saving each log format, opening and seeking logs in
+Playback and the plotter's per-frame work, on seeded synthetic scenarios.
+Results are written as JSON, and compared against a stored baseline with any
+result more than the tolerance slower or larger reported as a regression.
+
+    python -m benchmarks.run [--quick] [--out results.json]
+                             [--baseline benchmarks/baseline.json]
+                             [--tolerance 0.25] [--update-baseline]
+
+Timings depend on the machine, so the baseline should be recorded with
+--update-baseline on the machine the comparisons are made on.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+from benchmarks.scenarios import make_scenario
+from mass_simulator.main import MASSsim
+from mass_simulator.playback import Playback
+from mass_simulator.logger import LOG_EXTENSIONS
+from mass_simulator.scenario import compile_scenario
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def _best_of(func, repeat=3):
+    """Return the shortest of repeat timings of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        t = perf_counter()
+        func()
+        times.append(perf_counter() - t)
+    return min(times)
+
+
+def _make_sim(n_vessels, **kwargs):
+    kwargs.setdefault('log_dir', None)
+    return MASSsim(scenario=make_scenario(n_vessels),
+                   mode="test",
+                   plotter=False,
+                   **kwargs)
+
+
+def _access_encounters(mass_sim):
+    # The fleet engine computes the encounters when they're first used after
+    # a step, so they're used every step, as a controller would, to compare
+    # like with like against the agent engine which computes them in the step
+    fleet = getattr(mass_sim, '_fleet', None)
+    if fleet is not None:
+        if fleet.encounter_range_m is None:
+            fleet.get_encounters()
+        else:
+            fleet.get_encounter_pairs()
+    return False
+
+
+def bench_stepping(results, quick):
+    """Time per step, including the encounter metrics, against the number of
+    vessels for each engine"""
+    sizes = [2, 10, 100] if quick else [2, 10, 100, 300, 1000]
+    for n in sizes:
+        engines = [('agent', {}),
+                   ('fleet', {}),
+                   ('fleet_grid', {'encounter_range_m': 2000.})]
+        for name, kwargs in engines:
+            # The agent engine is quadratic in Python, so is left out of the
+            # large scenarios
+            if name == 'agent' and n > 100:
+                continue
+            engine = 'agent' if name == 'agent' else 'fleet'
+            n_steps = max(5, min(200, 2000//n))
+            mass_sim = _make_sim(n, engine=engine, **kwargs)
+            t = _best_of(lambda: mass_sim.run_steps(
+                n_steps, stop=_access_encounters))
+            results[f"step_{name}_{n}_vessels"] = (1e6*t/n_steps, "us/step")
+
+
+def bench_episode_length(results, quick):
+    """Time per step at different points of a long episode, which shows any
+    cost growing with the length of the history"""
+    lengths = [100, 1000] if quick else [100, 1000, 10000]
+    for engine in ['agent', 'fleet']:
+        mass_sim = _make_sim(10, engine=engine)
+        done = 0
+        for length in lengths:
+            mass_sim.run_steps(length - done - 100)
+            t = _best_of(lambda: mass_sim.run_steps(100), repeat=1)
+            done = length
+            results[f"episode_{engine}_at_{length}_steps"] = (1e6*t/100,
+                                                              "us/step")
+
+
+def bench_encounters(results, quick):
+    """Time to compute the encounter metrics to every other vessel"""
+    sizes = [10, 50] if quick else [10, 50, 100]
+    for n in sizes:
+        mass_sim = _make_sim(n, engine='agent')
+        mass_sim.run_steps(10)
+        vessels = mass_sim.get_obs()['vessels']
+        agent = vessels['agent']
+        t = _best_of(lambda: agent.update_other_vessels(vessels))
+        results[f"update_other_vessels_{n}_vessels"] = (1e6*t, "us/call")
+
+    for n in sizes + [1000]:
+        mass_sim = _make_sim(n, engine='fleet')
+        mass_sim.run_steps(10)
+        fleet = mass_sim._fleet
+
+        def encounters():
+            fleet._invalidate_encounters()
+            fleet.get_encounters()
+        t = _best_of(encounters)
+        results[f"fleet_encounters_{n}_vessels"] = (1e6*t, "us/call")
+
+        # The same with the grid search for the pairs within range
+        mass_sim = _make_sim(n, engine='fleet', encounter_range_m=2000.)
+        mass_sim.run_steps(10)
+        fleet = mass_sim._fleet
+
+        def encounter_pairs():
+            fleet._invalidate_encounters()
+            fleet.get_encounter_pairs()
+        t = _best_of(encounter_pairs)
+        results[f"fleet_grid_encounters_{n}_vessels"] = (1e6*t, "us/call")
+
+
+def bench_logging(results, quick, log_dir):
+    """Time to log and save an episode in each format and the file size.
+    Returns the paths of the logs for the playback benchmarks"""
+    n_vessels = 20
+    n_steps = 500 if quick else 2000
+    paths = {}
+    for log_format in LOG_EXTENSIONS:
+        mass_sim = _make_sim(n_vessels,
+                             log_dir=os.path.join(log_dir, log_format),
+                             log_format=log_format)
+        # Commands are logged for the commands format to re-simulate
+        for i in range(0, n_steps, 100):
+            mass_sim.set_speed('agent', 5. + i/100)
+            mass_sim.run_steps(100)
+        t = perf_counter()
+        mass_sim.save_episode()
+        t = perf_counter() - t
+        paths[log_format] = mass_sim.get_log_path()
+        results[f"log_{log_format}_save"] = (1e3*t, "ms")
+        results[f"log_{log_format}_size"] = (
+            os.path.getsize(paths[log_format])/1e6, "MB")
+
+        # Time the logging overhead per step separately from the save
+        unlogged = _make_sim(n_vessels)
+        logged = _make_sim(n_vessels,
+                           log_dir=os.path.join(log_dir, "overhead"),
+                           log_format=log_format)
+        t_unlogged = _best_of(lambda: unlogged.run_steps(100), repeat=1)
+        t_logged = _best_of(lambda: logged.run_steps(100), repeat=1)
+        logged.save_episode()
+        results[f"log_{log_format}_overhead"] = (
+            1e6*max(t_logged - t_unlogged, 0.)/100, "us/step")
+    return paths
+
+
+def bench_playback(results, paths):
+    """Time to open each log, seek to the middle and step through it"""
+    for log_format, path in paths.items():
+        t = perf_counter()
+        playback = Playback(path)
+        t_open = perf_counter() - t
+
+        t = perf_counter()
+        playback.set_t(playback.t_max/2)
+        playback.get_current_step()
+        t_seek = perf_counter() - t
+
+        n_steps = min(200, playback.N - playback.n - 1)
+        t = perf_counter()
+        for _ in range(n_steps):
+            playback.next_step()
+            playback.get_current_step()
+        t_step = (perf_counter() - t)/max(n_steps, 1)
+        playback.close()
+
+        results[f"playback_{log_format}_open"] = (1e3*t_open, "ms")
+        results[f"playback_{log_format}_seek"] = (1e3*t_seek, "ms")
+        results[f"playback_{log_format}_step"] = (1e6*t_step, "us/step")
+
+
+def bench_plotter(results, quick):
+    """Time of the plotter's work each frame, drawing to a stand-in for
+    dearpygui so no display is needed"""
+    from benchmarks import dpg_stub
+    dpg_stub.install()
+    from mass_simulator.plotter import Plotter
+
+    n_frames = 300 if quick else 2000
+    mass_sim = _make_sim(6)
+    vessels = mass_sim.get_obs()['vessels']
+    xy_lim = compile_scenario(make_scenario(6)).xy_lim
+    plotter = Plotter(vessels, xy_lim, control=False)
+    frame_s = []
+    for _ in range(n_frames):
+        mass_sim.next_step()
+        t = perf_counter()
+        plotter.update_time(mass_sim._world.t_elapsed)
+        plotter.update_vessels(vessels)
+        frame_s.append(perf_counter() - t)
+    frame_s = np.array(frame_s)
+    results["plotter_frame_mean"] = (1e3*frame_s.mean(), "ms")
+    results["plotter_frame_p99"] = (1e3*np.percentile(frame_s, 99), "ms")
+
+
+def bench_import(results):
+    """Time to import the package in a new process, on top of numpy"""
+    code = ("import numpy; from time import perf_counter; "
+            "t = perf_counter(); import mass_simulator.main; "
+            "print(perf_counter() - t)")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(os.path.dirname(__file__), '..'),
+         env.get('PYTHONPATH', '')])
+    times = []
+    for _ in range(3):
+        out = subprocess.run([sys.executable, '-c', code],
+                             capture_output=True,
+                             text=True,
+                             env=env,
+                             check=True)
+        times.append(float(out.stdout))
+    results["import_main"] = (1e3*min(times), "ms")
+
+
+def run(quick=False):
+    results = {}
+    bench_stepping(results, quick)
+    bench_episode_length(results, quick)
+    bench_encounters(results, quick)
+    with tempfile.TemporaryDirectory() as log_dir:
+        paths = bench_logging(results, quick, log_dir)
+        bench_playback(results, paths)
+    bench_plotter(results, quick)
+    bench_import(results)
+    return {'meta': {'quick': quick,
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'machine': platform.machine(),
+                     'platform': platform.platform()},
+            'results': {name: {'value': float(value), 'unit': unit}
+                        for name, (value, unit) in results.items()}}
+
+
+def compare(report, baseline, tolerance):
+    """Return the results more than tolerance slower, or larger, than the
+    baseline, as (name, value, baseline value) tuples"""
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or base['value'] <= 0:
+            continue
+        if result['value'] > (1 + tolerance)*base['value']:
+            regressions.append((name, result['value'], base['value']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--quick', action='store_true',
+                        help="smaller workloads for a fast check")
+    parser.add_argument('--out', default=None,
+                        help="file to write the results to as JSON")
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help="results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="fraction slower than the baseline allowed")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    report = run(quick=args.quick)
+    for name, result in report['results'].items():
+        print(f"{name:40s} {result['value']:12.3f} {result['unit']}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=4)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} to compare with.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['meta'].get('quick') != args.quick:
+        print("Warning: the baseline was recorded with " +
+              f"quick={baseline['meta'].get('quick')}.")
+    regressions = compare(report, baseline, args.tolerance)
+    for name, value, base in regressions:
+        print(f"Regression: {name} {value:.3f} against {base:.3f} " +
+              f"({value/base - 1:+.0%})")
+    if not regressions:
+        print(f"No regressions against {args.baseline}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
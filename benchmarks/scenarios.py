@@ -0,0 +1,32 @@
+import numpy as np
+
+# Centre of the synthetic scenarios in UTM zone 30, near the bundled ones
+CENTRE_XY = (430_000., 5_555_000.)
+
+
+def make_scenario(n_vessels: int,
+                  seed: int = 0,
+                  radius_m: float = 20_000.,
+                  t_step: float = 1.):
+    """Return a scenario dictionary with n_vessels crossing a circle of
+    radius_m. Each vessel starts on the circle and heads through a waypoint
+    near the centre to the far side. Waypoints are given in UTM so no
+    projection is needed, and the first vessel is the 'agent'"""
+    rng = np.random.default_rng([seed, n_vessels])
+    x_c, y_c = CENTRE_XY
+    vessels = []
+    for i in range(n_vessels):
+        angle = rng.uniform(0, 2*np.pi)
+        start = [x_c + radius_m*np.sin(angle),
+                 y_c + radius_m*np.cos(angle)]
+        middle = [x_c + rng.normal(0, radius_m/10),
+                  y_c + rng.normal(0, radius_m/10)]
+        goal_angle = angle + np.pi + rng.normal(0, 0.3)
+        goal = [x_c + radius_m*np.sin(goal_angle),
+                y_c + radius_m*np.cos(goal_angle)]
+        vessels.append({'vessel': 'agent' if i == 0 else f"vessel{i}",
+                        'speed_kn': float(rng.uniform(5, 20)),
+                        'waypoints': [start, middle, goal]})
+    return {'params': {'t_step': t_step,
+                       'utm_zone': 30},
+            'vessel_details': vessels}
@@ -1,6 +1,7 @@
 import numpy as np
 from dataclasses import dataclass
 from mass_simulator.general import *
+from mass_simulator.history import History
 
 
 class Agent():
@@ -9,11 +10,29 @@ class Agent():
                  xy_init,
                  waypoints,
                  speed_kn: float = 0.,
-                 speed_mps: float = 0.):
+                 speed_mps: float = 0.,
+                 hist_max_len: int = None,
+                 hist_policy: str = "ring"):
         # Agent parameters
         self.vessel_id = vessel_id
+        self.xy_hist = History(max_len=hist_max_len,
+                               policy=hist_policy)
+        self.other_vessels = {}
+        self.reset(xy_init,
+                   waypoints,
+                   speed_kn=speed_kn,
+                   speed_mps=speed_mps)
+
+    def reset(self,
+              xy_init,
+              waypoints,
+              speed_kn: float = 0.,
+              speed_mps: float = 0.):
+        """Restore the vessel to its initial conditions, reusing its history
+        buffer"""
         self.xy = xy_init
-        self.xy_hist = [xy_init]
+        self.xy_hist.clear()
+        self.xy_hist.append(xy_init[0:2])
 
         # Set boat initial speed in either knots or m/s
         if speed_kn:
@@ -25,7 +44,7 @@ class Agent():
         else:
             raise ValueError(f"No speed specified for vessel {self.vessel_id}")
 
-        self.other_vessels = {}
+        self.other_vessels.clear()
         self.waypoints = waypoints
         self.waypoint_n = 1
         self.goal_waypoint = waypoints[-1]
@@ -38,6 +57,7 @@ class Agent():
 
     def next_step(self,
                   t_step):
+        xy_prev = self.xy
         self.xy = [self.xy[0]+self.xy_step[0]*t_step,
                    self.xy[1]+self.xy_step[1]*t_step]
         self.xy_hist.append(self.xy)
@@ -45,7 +65,7 @@ class Agent():
         if self.waypoint_n < len(self.waypoints):
             # Get distance to current waypoint
             d = compute_perp_distance(self.xy,
-                                      self.xy_hist[-2],
+                                      xy_prev,
                                       self.waypoints[self.waypoint_n])
             if d < 50:
                 if self.waypoint_n < len(self.waypoints)-1:
@@ -127,3 +147,4 @@ class OtherVessel:
     range_m: float
     range_yds: float
     bearing_deg: float
+    in_range: bool = True
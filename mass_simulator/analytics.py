@@ -0,0 +1,188 @@
+import os
+import re
+import csv
+import multiprocessing
+import numpy as np
+from mass_simulator.logger import LOG_EXTENSIONS
+from mass_simulator.playback import open_log_reader
+from mass_simulator.general import *
+
+# Distance within which a vessel counts as having reached its goal, as in
+# Agent.next_step
+ARRIVAL_M = 50.
+
+# Largest number of pair-steps computed at once, bounding the memory used
+# by logs with many vessels
+MAX_PAIR_STEPS = 4_000_000
+
+TABLE_COLUMNS = ['log', 'vessel_1', 'vessel_2', 'metric', 'value']
+
+
+def find_logs(log_dir: str):
+    """Return the paths of the logs of every format in log_dir and its
+    subdirectories, such as the episode directories of a batch, in natural
+    order so log_2 comes before log_10"""
+    paths = []
+    for root, dirs, files in os.walk(log_dir):
+        for f in files:
+            if f.startswith('log_') and \
+                    f.endswith(tuple(LOG_EXTENSIONS.values())):
+                paths.append(os.path.join(root, f))
+
+    def natural(path):
+        return [int(s) if s.isdigit() else s
+                for s in re.split(r'(\d+)', path)]
+    return sorted(paths, key=natural)
+
+
+def load_trajectories(log_file: str):
+    """Read a log of any format into arrays. Returns the times, shape (T,),
+    the vessel ids, the states, shape (T, N, 4) with the fields of
+    columnar.STATE_FIELDS, and the waypoints of each vessel at the first
+    step"""
+    reader = open_log_reader(log_file, lazy=False)
+    try:
+        reader.load_all()
+        time = np.array(reader.time, dtype=float)
+        state = np.array(reader.state, dtype=float)
+        vessel_ids = list(reader.vessel_ids)
+        waypoints = {vessel_id: reader.get_waypoints(vessel_id, 0)
+                     for vessel_id in vessel_ids}
+    finally:
+        reader.close()
+    return time, vessel_ids, state, waypoints
+
+
+def compute_log_metrics(log_file: str):
+    """Compute the metrics of one log as rows of the table returned by
+    analyse_logs. Per log: the number of steps and duration. Per vessel:
+    the path length, the time the goal was reached (nan if it wasn't), and
+    the mean and maximum cross-track deviation from the route planned at the
+    first step. Per pair: the minimum range and when it happened, and the
+    minimum CPA while the vessels were closing, computed from the logged
+    courses and speeds with the same maths as general.compute_cpa"""
+    time, vessel_ids, state, waypoints = load_trajectories(log_file)
+    rows = [(log_file, '', '', 'n_steps', float(len(time))),
+            (log_file, '', '', 'duration_s',
+             float(time[-1] - time[0]) if len(time) else 0.)]
+
+    xy = state[..., 0:2]
+    for i, vessel_id in enumerate(vessel_ids):
+        xy_i = xy[:, i][~np.isnan(xy[:, i, 0])]
+        t_i = time[~np.isnan(xy[:, i, 0])]
+        route = np.array([wp[0:2] for wp in waypoints[vessel_id]],
+                         dtype=float)
+        steps = np.sqrt(((xy_i[1:] - xy_i[:-1])**2).sum(axis=1))
+
+        # The goal is reached on the first step which passes within
+        # ARRIVAL_M of it
+        arrived = np.flatnonzero(
+            compute_perp_distances(xy_i[:-1], xy_i[1:], route[-1]) <
+            ARRIVAL_M)
+        t_goal = t_i[arrived[0]+1] if len(arrived) else np.nan
+
+        # Cross-track deviation, the distance to the nearest leg of the route
+        if len(route) > 1:
+            deviation = compute_perp_distances(route[None, :-1],
+                                               route[None, 1:],
+                                               xy_i[:, None]).min(axis=1)
+        else:
+            deviation = np.sqrt(((xy_i - route[0])**2).sum(axis=1))
+        rows += [(log_file, vessel_id, '', 'path_length_m',
+                  float(steps.sum())),
+                 (log_file, vessel_id, '', 'time_to_goal_s', float(t_goal)),
+                 (log_file, vessel_id, '', 'mean_deviation_m',
+                  float(deviation.mean()) if len(deviation) else np.nan),
+                 (log_file, vessel_id, '', 'max_deviation_m',
+                  float(deviation.max()) if len(deviation) else np.nan)]
+
+    rows += _compute_pair_metrics(log_file, time, vessel_ids, state)
+    return rows
+
+
+def _compute_pair_metrics(log_file, time, vessel_ids, state):
+    N = len(vessel_ids)
+    i, j = np.triu_indices(N, k=1)
+    if len(i) == 0 or len(time) == 0:
+        return []
+    course_rad = np.deg2rad(state[..., 2])
+    velocity = state[..., 3:4]*np.stack([np.sin(course_rad),
+                                         np.cos(course_rad)], axis=-1)
+
+    min_range = np.full(len(i), np.inf)
+    t_min_range = np.full(len(i), np.nan)
+    min_cpa = np.full(len(i), np.inf)
+    # Work through the log a block of steps at a time
+    block = max(MAX_PAIR_STEPS//len(i), 1)
+    for n in range(0, len(time), block):
+        xy = state[n:n+block, :, 0:2]
+        v = velocity[n:n+block]
+        cpa_m, tcpa_s, range_m, _ = compute_encounters(xy[:, i], v[:, i],
+                                                       xy[:, j], v[:, j])
+        range_m = np.where(np.isnan(range_m), np.inf, range_m)
+        k = range_m.argmin(axis=0)
+        block_min = range_m[k, np.arange(len(i))]
+        closer = block_min < min_range
+        min_range[closer] = block_min[closer]
+        t_min_range[closer] = time[n:n+block][k[closer]]
+        # Only while the vessels are closing
+        cpa_m = np.where(tcpa_s > 0, cpa_m, np.inf)
+        min_cpa = np.minimum(min_cpa, np.nanmin(cpa_m, axis=0,
+                                                initial=np.inf))
+
+    rows = []
+    for p in range(len(i)):
+        vessel_1, vessel_2 = vessel_ids[i[p]], vessel_ids[j[p]]
+        rows += [(log_file, vessel_1, vessel_2, 'min_range_m',
+                  float(min_range[p]) if np.isfinite(min_range[p])
+                  else np.nan),
+                 (log_file, vessel_1, vessel_2, 't_min_range_s',
+                  float(t_min_range[p])),
+                 (log_file, vessel_1, vessel_2, 'min_cpa_m',
+                  float(min_cpa[p]) if np.isfinite(min_cpa[p])
+                  else np.nan)]
+    return rows
+
+
+def _analyse_log(log_file):
+    try:
+        return log_file, compute_log_metrics(log_file), ""
+    except Exception as e:
+        return log_file, [], repr(e)
+
+
+def analyse_logs(logs: str | list,
+                 n_workers: int = None,
+                 chunksize: int = 4):
+    """Compute the metrics of compute_log_metrics for every log in a
+    directory, or in a list of paths, across a process pool. Returns a tidy
+    table, a dictionary of equal length arrays with the columns
+    TABLE_COLUMNS and one row per metric, in the order of the logs, and the
+    errors of any logs which couldn't be read, {log_file: error}. vessel_1
+    and vessel_2 are empty for metrics of a whole log, and vessel_2 is empty
+    for metrics of a single vessel"""
+    paths = find_logs(logs) if isinstance(logs, str) else list(logs)
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1 or len(paths) <= 1:
+        results = list(map(_analyse_log, paths))
+    else:
+        with multiprocessing.Pool(min(n_workers, len(paths))) as pool:
+            results = list(pool.imap(_analyse_log, paths,
+                                     chunksize=chunksize))
+
+    rows = [row for _, log_rows, _ in results for row in log_rows]
+    errors = {log_file: error for log_file, _, error in results if error}
+    columns = list(zip(*rows)) if rows else [[]]*len(TABLE_COLUMNS)
+    table = {name: np.array(column, dtype=str)
+             for name, column in zip(TABLE_COLUMNS[:-1], columns[:-1])}
+    table['value'] = np.array(columns[-1], dtype=float)
+    return table, errors
+
+
+def save_table(table: dict,
+               path: str):
+    """Write a table returned by analyse_logs as CSV"""
+    with open(path, 'w', newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(TABLE_COLUMNS)
+        writer.writerows(zip(*[table[name] for name in TABLE_COLUMNS]))
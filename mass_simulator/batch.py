@@ -0,0 +1,237 @@
+import os
+import copy
+import glob
+import json
+import multiprocessing
+import numpy as np
+from dataclasses import dataclass
+from time import time
+from mass_simulator.main import MASSsim
+from mass_simulator.scenario import compile_scenario
+from mass_simulator.general import *
+
+
+@dataclass
+class Episode:
+    """ A single test mode episode of a batch.
+
+    scenario is anything accepted by MASSsim, or a scenario dictionary.
+    controller is called as controller(mass_sim, rng) after every step and can
+    read the observations and set waypoints.
+    params can contain:
+        'params': dictionary merged into the scenario params
+        'vessels': {vessel_id: dictionary merged into the vessel details}
+        'speed_scale': factor applied to the speed of every vessel
+        'speed_jitter': standard deviation of a random factor applied to the
+                        speed of each vessel, which is kept to at least 0.1
+        'waypoint_jitter_m': standard deviation of random offsets added to
+                             every waypoint after the starting position. The
+                             waypoints are then given in UTM, so the logged
+                             setup has the waypoints which were run
+    seed overrides the seed derived from the batch seed and episode number.
+    """
+    scenario: int | str | dict
+    controller: callable = None
+    params: dict = None
+    seed: int = None
+
+
+# Scenario configs loaded once per worker process
+_scenario_cache = {}
+
+
+def _init_worker(scenarios):
+    for scenario in scenarios:
+        _load_scenario(scenario)
+
+
+def _load_scenario(scenario):
+    if isinstance(scenario, dict):
+        return scenario
+    if scenario not in _scenario_cache:
+        _scenario_cache[scenario] = MASSsim._get_scenario(scenario)
+    return _scenario_cache[scenario]
+
+
+def _apply_params(conf, params, rng):
+    conf = copy.deepcopy(conf)
+    conf['params'].update(params.get('params', {}))
+
+    vessel_params = params.get('vessels', {})
+    for v in conf['vessel_details']:
+        if v['vessel'] in vessel_params:
+            v.update(vessel_params[v['vessel']])
+
+        # Scale the speed in whichever unit is given
+        scale = params.get('speed_scale', 1.)
+        if 'speed_jitter' in params:
+            # A factor of zero or less would stop the vessel or send it
+            # backwards, so it would never arrive
+            scale *= max(1 + rng.normal(0, params['speed_jitter']), 0.1)
+        key = 'speed_mps' if 'speed_mps' in v else 'speed_kn'
+        v[key] = v[key]*scale
+    return conf
+
+
+def _jitter_waypoints(conf, sigma_m, rng):
+    # The offsets are in metres, so the jittered waypoints replace those of
+    # the scenario in UTM, in the zone they were projected to
+    scenario = compile_scenario(conf)
+    for v, waypoints in zip(conf['vessel_details'], scenario.waypoints):
+        waypoints = [wp[0:2] if np.isnan(wp[2]) else wp
+                     for wp in waypoints.tolist()]
+        for wp in waypoints[1:]:
+            wp[0] += rng.normal(0, sigma_m)
+            wp[1] += rng.normal(0, sigma_m)
+        v['waypoints'] = waypoints
+    if scenario.utm_zone is not None:
+        conf['params']['utm_zone'] = scenario.utm_zone
+    return conf
+
+
+def _min_range(vessels):
+    xy = np.array([v.xy[0:2] for v in vessels.values()])
+    range_m = np.sqrt(((xy[:, None] - xy[None, :])**2).sum(axis=2))
+    range_m[np.diag_indices(len(xy))] = np.inf
+    return range_m.min()
+
+
+def _run_episode(task):
+    episode_id, episode, seed, log_dir, engine = task
+    t_0 = time()
+    rng = np.random.default_rng(seed)
+    params = episode.params or {}
+    scenario = episode.scenario
+    summary = {'episode_id': episode_id,
+               'scenario': 'custom' if isinstance(scenario, dict) else scenario,
+               'seed': seed}
+
+    # Remove any log left behind by an interrupted run of this episode
+    for f in glob.glob(os.path.join(log_dir, 'log_*')):
+        os.remove(f)
+
+    try:
+        conf = _apply_params(_load_scenario(episode.scenario), params, rng)
+        if 'waypoint_jitter_m' in params:
+            conf = _jitter_waypoints(conf, params['waypoint_jitter_m'], rng)
+        mass_sim = MASSsim(scenario=conf,
+                           mode='test',
+                           plotter=False,
+                           log_dir=log_dir,
+                           engine=engine)
+
+        t_max = conf['params'].get('t_max', np.inf)
+        n_steps = 0
+        min_range_m = np.inf
+        while mass_sim.is_episode_running() and \
+                mass_sim.get_obs()['time_s'] < t_max:
+            mass_sim.next_step()
+            n_steps += 1
+            if episode.controller is not None:
+                episode.controller(mass_sim, rng)
+            min_range_m = min(min_range_m,
+                              _min_range(mass_sim.get_obs()['vessels']))
+        mass_sim.save_episode()
+
+        summary['t_end'] = mass_sim.get_obs()['time_s']
+        summary['n_steps'] = n_steps
+        summary['finished'] = not mass_sim.is_episode_running()
+        summary['min_range_m'] = float(min_range_m)
+        summary['log_path'] = mass_sim.get_log_path()
+        summary['error'] = ""
+    except Exception as e:
+        summary['error'] = repr(e)
+    summary['wall_time_s'] = time() - t_0
+    return summary
+
+
+class BatchRunner():
+    """ Runs many test mode episodes in parallel across a process pool.
+
+    Every completed episode is appended to results.jsonl in out_dir, so a
+    batch that is interrupted can be run again and only the missing episodes
+    are simulated. Each episode's random generator is seeded from the batch
+    seed and the episode number so reruns give identical results.
+    """
+
+    def __init__(self,
+                 episodes: list,
+                 out_dir: str = "batch/",
+                 n_workers: int = None,
+                 seed: int = 0,
+                 engine: str = "agent",
+                 chunksize: int = 1):
+        self.episodes = episodes
+        self.out_dir = os.path.abspath(out_dir)
+        self.n_workers = n_workers or os.cpu_count()
+        self.seed = seed
+        self.engine = engine
+        self.chunksize = chunksize
+        self.results_path = os.path.join(self.out_dir, 'results.jsonl')
+
+    def _get_seed(self, episode_id):
+        episode = self.episodes[episode_id]
+        if episode.seed is not None:
+            return episode.seed
+        seed_seq = np.random.SeedSequence([self.seed, episode_id])
+        return int(seed_seq.generate_state(1)[0])
+
+    def _load_results(self):
+        results = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as f:
+                for line in f:
+                    # Skip a partly written line from a crash
+                    try:
+                        r = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    # Episodes which failed are run again
+                    if r['error'] == "":
+                        results[r['episode_id']] = r
+                    else:
+                        results.pop(r['episode_id'], None)
+        return results
+
+    def run(self):
+        """Run every episode that hasn't already completed and return the
+        summaries of all of the episodes ordered by episode_id"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        results = self._load_results()
+
+        tasks = []
+        for episode_id, episode in enumerate(self.episodes):
+            if episode_id in results:
+                continue
+            log_dir = os.path.join(self.out_dir, f"episode_{episode_id}")
+            tasks.append((episode_id, episode, self._get_seed(episode_id),
+                          log_dir, self.engine))
+
+        scenarios = set(e.scenario for e in self.episodes
+                        if not isinstance(e.scenario, dict))
+        with open(self.results_path, 'a+') as f:
+            # Terminate a partly written line from a crash
+            if f.tell() > 0:
+                f.seek(f.tell()-1)
+                if f.read(1) != "\n":
+                    f.write("\n")
+            if self.n_workers == 1:
+                _init_worker(scenarios)
+                summaries = map(_run_episode, tasks)
+                self._record(f, results, summaries)
+            else:
+                with multiprocessing.Pool(self.n_workers,
+                                          initializer=_init_worker,
+                                          initargs=(scenarios,)) as pool:
+                    summaries = pool.imap_unordered(_run_episode,
+                                                    tasks,
+                                                    chunksize=self.chunksize)
+                    self._record(f, results, summaries)
+
+        return [results[n] for n in sorted(results)]
+
+    def _record(self, f, results, summaries):
+        for summary in summaries:
+            results[summary['episode_id']] = summary
+            f.write(json.dumps(summary) + "\n")
+            f.flush()
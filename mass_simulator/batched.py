@@ -0,0 +1,180 @@
+import numpy as np
+from mass_simulator.main import MASSsim
+from mass_simulator.agent import Agent
+from mass_simulator.general import *
+
+
+class BatchedMASSsim():
+    """ Steps n_episodes copies of the same scenario in lockstep. The vessel
+    state is held in arrays with a leading episode axis, shape (B, N, ...),
+    and every episode is advanced with the same vectorised update as
+    Agent.next_step. Episodes which finish are reset automatically.
+
+    Actions are new waypoints with shape (B, N, 2). A row which isn't nan is
+    applied like MASSsim.set_waypoints(vessel_id, [[x, y]]), so the vessel
+    heads for that waypoint and then on to its goal waypoint.
+    """
+
+    def __init__(self,
+                 scenario: int | str | dict,
+                 n_episodes: int,
+                 t_max: float = None,
+                 encounters: bool = True):
+        v: Agent
+        conf = MASSsim._get_scenario(scenario=scenario)
+        _, params, vessels, _ = MASSsim._setup_scene(conf)
+
+        self.B = n_episodes
+        self.N = len(vessels)
+        self.vessel_ids = list(vessels.keys())
+        self.t_step = params['t_step']
+        self.t_max = t_max if t_max is not None else params.get('t_max',
+                                                                np.inf)
+        self._encounters = encounters
+
+        # Initial state of a single episode. There is room for at least two
+        # waypoints so any vessel can be sent to a new waypoint and its goal
+        W = max(2, max(len(v.waypoints) for v in vessels.values()))
+        self._xy_0 = np.zeros((self.N, 2))
+        self._xy_step_0 = np.zeros((self.N, 2))
+        self._course_deg_0 = np.zeros(self.N)
+        self._speed_mps_0 = np.zeros(self.N)
+        self._waypoints_0 = np.zeros((self.N, W, 2))
+        self._n_waypoints_0 = np.zeros(self.N, dtype=int)
+        self._waypoint_n_0 = np.zeros(self.N, dtype=int)
+        for i, v in enumerate(vessels.values()):
+            self._xy_0[i] = v.xy[0:2]
+            self._xy_step_0[i] = v.xy_step
+            self._course_deg_0[i] = v.course_deg
+            self._speed_mps_0[i] = v.speed_mps
+            self._waypoints_0[i, :len(v.waypoints)] = \
+                [wp[0:2] for wp in v.waypoints]
+            self._n_waypoints_0[i] = len(v.waypoints)
+            self._waypoint_n_0[i] = v.waypoint_n
+        self._goal_waypoint = self._waypoints_0[np.arange(self.N),
+                                                self._n_waypoints_0-1]
+
+        # Batched state
+        self.t = np.zeros(self.B)
+        self.xy = np.zeros((self.B, self.N, 2))
+        self.xy_step = np.zeros((self.B, self.N, 2))
+        self.course_deg = np.zeros((self.B, self.N))
+        self.speed_mps = np.zeros((self.B, self.N))
+        self.waypoints = np.zeros((self.B, self.N, W, 2))
+        self.n_waypoints = np.zeros((self.B, self.N), dtype=int)
+        self.waypoint_n = np.zeros((self.B, self.N), dtype=int)
+        self.final_waypoint_reached = np.zeros((self.B, self.N), dtype=bool)
+        self.episode_count = np.zeros(self.B, dtype=int)
+        self.reset()
+
+    def reset(self, episodes=None):
+        """Restore the initial conditions of the given episodes, or of all
+        of them, and return the observations"""
+        if episodes is None:
+            episodes = np.ones(self.B, dtype=bool)
+        self._reset_state(episodes)
+        return self.get_obs()
+
+    def _reset_state(self, episodes):
+        self.t[episodes] = 0
+        self.xy[episodes] = self._xy_0
+        self.xy_step[episodes] = self._xy_step_0
+        self.course_deg[episodes] = self._course_deg_0
+        self.speed_mps[episodes] = self._speed_mps_0
+        self.waypoints[episodes] = self._waypoints_0
+        self.n_waypoints[episodes] = self._n_waypoints_0
+        self.waypoint_n[episodes] = self._waypoint_n_0
+        self.final_waypoint_reached[episodes] = False
+
+    def step(self, actions=None):
+        """Apply the actions, advance every episode by one time step and
+        reset those which have finished. Returns the stacked observations, a
+        (B,) array of which episodes finished on this step and an info
+        dictionary. The observations of finished episodes are those after
+        their reset, and their last observations before it are in
+        info['terminal_obs'], with one row per finished episode in order"""
+        if actions is not None:
+            self._set_waypoints(np.asarray(actions, dtype=float))
+
+        xy_prev = self.xy.copy()
+        self.xy += self.xy_step*self.t_step
+        self.t += self.t_step
+
+        # Distance from each vessel's current waypoint to the path travelled
+        # over the last step
+        target = self._get_targets()
+        d = compute_perp_distances(xy_prev, self.xy, target)
+        arrived = (self.waypoint_n < self.n_waypoints) & (d < 50)
+        advance = arrived & (self.waypoint_n < self.n_waypoints-1)
+        self.final_waypoint_reached |= arrived & ~advance
+
+        # Head for the next waypoint
+        if advance.any():
+            self.waypoint_n[advance] += 1
+            target = self._get_targets()
+            self._set_course(advance,
+                             compute_bearing(self.xy[advance].T,
+                                             target[advance].T))
+
+        done = self.final_waypoint_reached.all(axis=1) | (self.t >= self.t_max)
+        obs = self.get_obs()
+        info = {}
+        if done.any():
+            self.episode_count[done] += 1
+            info['terminal_obs'] = {key: value[done]
+                                    for key, value in obs.items()}
+            # Only the observations of the reset episodes are recomputed
+            self._reset_state(done)
+            for key, value in self.get_obs(done).items():
+                obs[key][done] = value
+        return obs, done, info
+
+    def _get_targets(self):
+        return np.take_along_axis(self.waypoints,
+                                  self.waypoint_n[..., None, None],
+                                  axis=2)[:, :, 0]
+
+    def _set_waypoints(self, waypoints):
+        new = ~np.isnan(waypoints).any(axis=2)
+        if not new.any():
+            return
+        _, n = np.nonzero(new)
+        self.waypoints[new, 0] = waypoints[new]
+        self.waypoints[new, 1] = self._goal_waypoint[n]
+        self.n_waypoints[new] = 2
+        self.waypoint_n[new] = 0
+        self._set_course(new,
+                         compute_bearing(self.xy[new].T,
+                                         waypoints[new].T))
+
+    def _set_course(self, mask, course_deg):
+        self.course_deg[mask] = course_deg
+        course_rad = np.deg2rad(course_deg)
+        self.xy_step[mask, 0] = self.speed_mps[mask]*np.sin(course_rad)
+        self.xy_step[mask, 1] = self.speed_mps[mask]*np.cos(course_rad)
+
+    def get_obs(self, episodes=None):
+        """Return the observations of the given episodes, or of all of them,
+        as copies of the state"""
+        if episodes is None:
+            episodes = slice(None)
+        obs_dict = {}
+        obs_dict['time_s'] = self.t[episodes].copy()
+        obs_dict['xy'] = self.xy[episodes].copy()
+        obs_dict['course_deg'] = self.course_deg[episodes].copy()
+        obs_dict['speed_mps'] = self.speed_mps[episodes].copy()
+        obs_dict['waypoint_n'] = self.waypoint_n[episodes].copy()
+        obs_dict['final_waypoint_reached'] = \
+            self.final_waypoint_reached[episodes].copy()
+        if self._encounters:
+            cpa_m, tcpa_s, range_m, bearing_deg = \
+                compute_encounter_matrices(self.xy[episodes],
+                                           self.xy_step[episodes])
+            obs_dict['cpa_m'] = cpa_m
+            obs_dict['tcpa_s'] = tcpa_s
+            obs_dict['range_m'] = range_m
+            obs_dict['bearing_deg'] = bearing_deg
+        return obs_dict
+
+    def get_vessel_index(self, vessel_id):
+        return self.vessel_ids.index(vessel_id)
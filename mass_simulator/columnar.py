@@ -0,0 +1,223 @@
+import os
+import json
+import bisect
+import zipfile
+import numpy as np
+
+# Columns of the state array of a columnar log
+STATE_FIELDS = ['x', 'y', 'course_deg', 'speed_mps']
+
+
+class ColumnarLog():
+    """ Writer for columnar logs. The state of every vessel is stored in a
+    (time, vessel, field) array with the fields in STATE_FIELDS, alongside the
+    times, the waypoint changes and any other per step entries. The log is
+    saved as an uncompressed .npz so it can be memory mapped when read.
+    """
+
+    def __init__(self,
+                 setup,
+                 float32: bool = False):
+        self.setup = setup
+        self.dtype = np.float32 if float32 else np.float64
+        self.vessel_ids = []
+        self._vessel_index = {}
+        self._time = np.zeros(64)
+        self._state = np.zeros((64, 0, len(STATE_FIELDS)), dtype=self.dtype)
+        self._waypoints = {}
+        self.waypoint_changes = []
+        self.extras = {}
+        self.n = -1
+
+    def next_step(self, t):
+        self.n += 1
+        if self.n == len(self._time):
+            self._time = np.concatenate([self._time,
+                                         np.zeros(len(self._time))])
+            self._state = np.concatenate([self._state,
+                                          np.full_like(self._state, np.nan)])
+        self._time[self.n] = t
+
+    def add_vessel(self,
+                   vessel_id,
+                   xy,
+                   course_deg,
+                   speed_mps,
+                   waypoints):
+        if vessel_id not in self._vessel_index:
+            self._add_column(vessel_id)
+        i = self._vessel_index[vessel_id]
+        self._state[self.n, i] = [xy[0], xy[1], course_deg, speed_mps]
+
+        # Only changes to the waypoints are stored
+        last = self._waypoints.get(vessel_id)
+        if waypoints is not last:
+            self._waypoints[vessel_id] = waypoints
+            if waypoints != last:
+                self.waypoint_changes.append(
+                    {'n': self.n,
+                     'vessel_id': vessel_id,
+                     'waypoints': [list(wp) for wp in waypoints]})
+
+    def _add_column(self, vessel_id):
+        self._vessel_index[vessel_id] = len(self.vessel_ids)
+        self.vessel_ids.append(vessel_id)
+        column = np.full((len(self._state), 1, len(STATE_FIELDS)),
+                         np.nan,
+                         dtype=self.dtype)
+        self._state = np.concatenate([self._state, column], axis=1)
+
+    def add_extra(self, key, value):
+        self.extras.setdefault(str(self.n), {})[key] = value
+
+    def get_log(self):
+        """Return the log in the same form as open_columnar_log"""
+        return {'time': self._time[:self.n+1],
+                'state': self._state[:self.n+1],
+                'vessel_ids': list(self.vessel_ids),
+                'setup': self.setup,
+                'waypoint_changes': self.waypoint_changes,
+                'extras': {int(n): e for n, e in self.extras.items()}}
+
+    def save(self, path):
+        # np.savez stores the arrays uncompressed, which allows memory mapping
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     time=self._time[:self.n+1],
+                     state=self._state[:self.n+1],
+                     vessel_ids=np.array(self.vessel_ids, dtype=str),
+                     setup=np.array(json.dumps(self.setup)),
+                     waypoint_changes=np.array(
+                         json.dumps(self.waypoint_changes)),
+                     extras=np.array(json.dumps(self.extras)))
+
+
+class LogReader():
+    """ Read access to a log in columnar form, as returned by
+    open_columnar_log or ColumnarLog.get_log. The whole log is available, so
+    load and prefetch do nothing.
+    """
+
+    def __init__(self,
+                 log: dict):
+        self.setup = log['setup']
+        self.time = log['time']
+        self.state = log['state']
+        self.vessel_ids = log['vessel_ids']
+        self._extras = log['extras']
+
+        # Waypoint changes of each vessel and the steps they happened at
+        self._waypoint_changes = {}
+        for c in log['waypoint_changes']:
+            n_changes, waypoints = self._waypoint_changes.setdefault(
+                c['vessel_id'], ([], []))
+            n_changes.append(c['n'])
+            waypoints.append(c['waypoints'])
+
+    def load(self, n):
+        """Make sure step n is available"""
+        pass
+
+    def prefetch(self, n, direction: int = 1):
+        """Start loading the steps after n, or before n if direction is
+        negative"""
+        pass
+
+    def load_all(self):
+        """Make sure every step is available"""
+        pass
+
+    def get_waypoints(self, vessel_id, n):
+        n_changes, waypoints = self._waypoint_changes[vessel_id]
+        return waypoints[max(bisect.bisect_right(n_changes, n)-1, 0)]
+
+    def get_extras(self, n):
+        return self._extras.get(n, {})
+
+    def close(self):
+        pass
+
+
+def open_columnar_log(path):
+    """Open a columnar log with the time and state arrays memory mapped, so
+    only the parts of the file which are used are read from disk"""
+    log = {}
+    with zipfile.ZipFile(path) as z, open(path, 'rb') as f:
+        for info in z.infolist():
+            name = info.filename[:-len('.npy')]
+            if name in ['time', 'state'] and \
+                    info.compress_type == zipfile.ZIP_STORED:
+                log[name] = _memmap_member(path, f, info)
+            else:
+                with z.open(info) as member:
+                    log[name] = np.lib.format.read_array(member)
+
+    log['vessel_ids'] = [str(v) for v in log['vessel_ids']]
+    log['setup'] = json.loads(str(log['setup']))
+    log['waypoint_changes'] = json.loads(str(log['waypoint_changes']))
+    log['extras'] = {int(n): e for n, e in
+                     json.loads(str(log['extras'])).items()}
+    return log
+
+
+def _memmap_member(path, f, info):
+    # Skip the zip local file header to get to the start of the .npy file
+    f.seek(info.header_offset)
+    header = f.read(30)
+    name_len = int.from_bytes(header[26:28], 'little')
+    extra_len = int.from_bytes(header[28:30], 'little')
+    f.seek(info.header_offset + 30 + name_len + extra_len)
+
+    # Then skip the .npy header to get to the data
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path,
+                     dtype=dtype,
+                     mode='r',
+                     offset=f.tell(),
+                     shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def load_json_log(log_file,
+                  float32: bool = False):
+    """Read a json or ndjson log into a ColumnarLog"""
+    with open(log_file, 'r') as f:
+        if log_file.endswith('.ndjson'):
+            setup = json.loads(f.readline())['setup']
+            # The last line is incomplete if the simulator crashed
+            steps = (json.loads(line) for line in f if line.endswith("\n"))
+        else:
+            log_dict = json.load(f)
+            setup = log_dict['setup']
+            steps = log_dict['log']
+
+        log = ColumnarLog(setup, float32=float32)
+        for step in steps:
+            log.next_step(step['time'])
+            for v in step['vessels']:
+                log.add_vessel(v['vessel_id'],
+                               v['xy'],
+                               v['course_deg'],
+                               v['speed_mps'],
+                               v['waypoints'])
+            for key in step:
+                if key not in ['time', 'vessels']:
+                    log.add_extra(key, step[key])
+    return log
+
+
+def convert_log(log_file,
+                out_file: str = None,
+                float32: bool = False):
+    """Convert a json or ndjson log to a columnar log, saved next to the
+    original with the .npz extension unless out_file is given"""
+    if out_file is None:
+        out_file = os.path.splitext(log_file)[0] + ".npz"
+    load_json_log(log_file, float32=float32).save(out_file)
+    return out_file
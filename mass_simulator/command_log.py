@@ -0,0 +1,108 @@
+import json
+import numpy as np
+from mass_simulator.agent import Agent
+from mass_simulator.fleet import Fleet
+from mass_simulator.lazy_log import ChunkedLogReader
+
+
+class CommandLogReader(ChunkedLogReader):
+    """ Reader for command logs, which only contain the setup, the commands
+    given to the vessels and periodic keyframes of the vessel states. The
+    steps between two keyframes are rebuilt by re-simulating from the first
+    keyframe and applying the commands at the steps they were given, so
+    seeking anywhere costs at most keyframe_every steps of simulation.
+    """
+
+    def __init__(self,
+                 log_file,
+                 prefetch: int = 2,
+                 backfill: bool = False):
+        self._keyframes = []
+        self._commands = {}
+        self._extras = {}
+        end = None
+        with open(log_file, 'r') as f:
+            header = json.loads(f.readline())
+            for line in f:
+                # The last line is incomplete if the simulator crashed
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                if 'keyframe' in record:
+                    self._keyframes.append(record)
+                elif 'command' in record:
+                    self._commands.setdefault(record['n'], []).append(record)
+                elif 'extra' in record:
+                    self._extras.setdefault(record['n'], {})[
+                        record['extra']] = record['value']
+                elif 'end' in record:
+                    end = record
+
+        self.setup = header['setup']
+        self.t_step = self.setup['params']['t_step']
+        self.vessel_ids = [v['vessel'] for v in self.setup['vessel_details']]
+
+        # Without an end record, the log finishes at the last keyframe
+        if end is None:
+            end = {'end': self._keyframes[-1]['keyframe'],
+                   'time': self._keyframes[-1]['time']}
+        chunk_starts = [kf['keyframe'] for kf in self._keyframes]
+        chunk_ends = chunk_starts[1:] + [end['end']+1]
+        self.time = np.concatenate(
+            [kf['time'] + self.t_step*np.arange(n_end - n_start)
+             for kf, n_start, n_end in zip(self._keyframes,
+                                           chunk_starts,
+                                           chunk_ends)])
+        self._start(chunk_starts, prefetch, backfill)
+
+    def _get_fleet(self, keyframe):
+        # Restore the vessels to the state in the keyframe
+        vessels = {}
+        for v in keyframe['vessels']:
+            agent = Agent(vessel_id=v['vessel_id'],
+                          xy_init=list(v['xy']),
+                          waypoints=[list(wp) for wp in v['waypoints']],
+                          speed_mps=v['speed_mps'] or 1.)
+            agent.update_speed(v['speed_mps'])
+            agent.speed_kn = v['speed_kn']
+            agent.waypoint_n = v['waypoint_n']
+            agent._final_waypoint_reached = v['final_waypoint_reached']
+            agent.update_course(v['course_deg'])
+            vessels[v['vessel_id']] = agent
+        return Fleet(vessels)
+
+    def _decode_chunk(self, c):
+        fleet = self._get_fleet(self._keyframes[c])
+        columns = [self._vessel_index[vessel_id]
+                   for vessel_id in fleet.vessel_ids]
+        start = self._chunk_starts[c]
+        waypoint_changes = {vessel_id: ([start], [fleet.waypoints[i]])
+                            for i, vessel_id in enumerate(fleet.vessel_ids)}
+        extras = {}
+
+        for n in range(start, self._get_chunk_end(c)):
+            if n > start:
+                fleet.next_step(self.t_step)
+            self.state[n, columns, 0:2] = fleet.xy
+            self.state[n, columns, 2] = fleet.course_deg
+            self.state[n, columns, 3] = fleet.speed_mps
+            if n in self._extras:
+                extras[n] = dict(self._extras[n])
+
+            # Commands given after this step, which show from the next step
+            for command in self._commands.get(n, []):
+                vessel = fleet.agents[command['vessel_id']]
+                if command['command'] == 'waypoints':
+                    vessel.update_waypoints([list(wp)
+                                             for wp in command['value']])
+                    n_changes, waypoints = \
+                        waypoint_changes[command['vessel_id']]
+                    n_changes.append(n+1)
+                    waypoints.append(vessel.waypoints)
+                elif command['command'] == 'speed':
+                    vessel.update_speed(command['value'])
+                elif command['command'] == 'course':
+                    vessel.update_course(command['value'])
+                extras.setdefault(n, {}).setdefault('commands',
+                                                    []).append(command)
+        return waypoint_changes, extras
@@ -0,0 +1,171 @@
+import numpy as np
+from dataclasses import dataclass
+from mass_simulator.spatial import find_neighbour_pairs
+
+
+@dataclass
+class EncounterEvent:
+    """ An event of an encounter between two vessels.
+
+    kind is 'start' when the vessels close within the encounter range,
+    'breach' when they close within one of the thresholds, given by range_m,
+    and 'end' when they separate beyond the encounter range again. End events
+    also give the minimum range of the encounter and when it happened.
+    """
+    kind: str
+    t_s: float
+    vessel_1: str
+    vessel_2: str
+    range_m: float
+    min_range_m: float = None
+    t_min_s: float = None
+
+
+class EncounterDetector():
+    """ Incremental detector of encounters and threshold breaches.
+
+    Between two updates every vessel moves in a straight line at constant
+    speed, so the separation of each pair over the interval is the distance
+    of a point moving in a straight line from the origin. Its minimum, and
+    the times the pair crosses the encounter range and each threshold, are
+    found exactly rather than only at the sampled steps, so close approaches
+    in the middle of a long step, or a run_events interval, aren't missed.
+
+    Only pairs which could come within range over the interval are checked,
+    found with the grid search of spatial.find_neighbour_pairs. Each update
+    returns the events in the interval in time order, and only the pairs in
+    an encounter are remembered, so consumers never need the trajectories.
+    """
+
+    def __init__(self,
+                 vessel_ids: list,
+                 range_m: float,
+                 thresholds_m: list = ()):
+        if any(th >= range_m for th in thresholds_m):
+            raise ValueError("Thresholds must be less than the encounter " +
+                             "range.")
+        self.range_m = range_m
+        # Largest first, the order they're breached in
+        self.thresholds_m = np.sort(np.asarray(thresholds_m, dtype=float)
+                                    )[::-1]
+        self.reset(vessel_ids)
+
+    def reset(self,
+              vessel_ids: list):
+        """Forget the open encounters and the last positions"""
+        self.vessel_ids = list(vessel_ids)
+        self.N = len(self.vessel_ids)
+        self._t = None
+        self._xy = None
+        # Open encounters by pair key i*N + j, with i < j, kept sorted
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._min_range = np.zeros(0)
+        self._t_min = np.zeros(0)
+        self._n_breached = np.zeros(0, dtype=np.int64)
+
+    def update(self,
+               t: float,
+               xy: np.ndarray):
+        """Move on to time t with the vessels at xy, shape (N, 2), and
+        return the events since the last update. The first update only finds
+        the pairs already within range"""
+        xy = np.array(xy, dtype=float)
+        if self._xy is None:
+            self._t, self._xy = t, xy
+        t0, xy0 = self._t, self._xy
+        self._t, self._xy = t, xy
+
+        # Pairs which could come within range, those already in an encounter
+        # being within range at the start
+        step = np.sqrt(((xy - xy0)**2).sum(axis=1)).max() if self.N else 0.
+        i, j = find_neighbour_pairs(xy0, self.range_m + 2*step)
+        keep = i < j
+        i, j = i[keep], j[keep]
+        keys = i*self.N + j
+
+        # Separation r0 + s*dr for s from 0 to 1 over the interval
+        r0 = xy0[j] - xy0[i]
+        dr = (xy[j] - xy[i]) - r0
+        a = (dr**2).sum(axis=1)
+        b = (r0*dr).sum(axis=1)
+        c = (r0**2).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s_min = np.where(a > 0, np.clip(-b/a, 0, 1), 0.)
+        d_min = np.sqrt(np.maximum(c + 2*b*s_min + a*s_min**2, 0))
+        d_end = np.sqrt(((xy[j] - xy[i])**2).sum(axis=1))
+
+        def crossing(radius, sign):
+            # s where the separation crosses radius, entering with sign -1
+            # and leaving with sign 1, for pairs which come within it
+            disc = np.maximum(b**2 - a*(c - radius**2), 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                s = np.where(a > 0, (-b + sign*np.sqrt(disc))/a, 0.)
+            return t0 + (t - t0)*np.clip(s, 0, 1)
+
+        # Match the candidates to the open encounters
+        if len(self._keys):
+            n = np.minimum(np.searchsorted(self._keys, keys),
+                           len(self._keys)-1)
+            is_open = self._keys[n] == keys
+            min_range = np.where(is_open, self._min_range[n], np.inf)
+            t_min = np.where(is_open, self._t_min[n], np.nan)
+            n_breached = np.where(is_open, self._n_breached[n], 0)
+        else:
+            is_open = np.zeros(len(keys), dtype=bool)
+            min_range = np.full(len(keys), np.inf)
+            t_min = np.full(len(keys), np.nan)
+            n_breached = np.zeros(len(keys), dtype=np.int64)
+        starting = ~is_open & (d_min < self.range_m)
+        in_encounter = is_open | starting
+        closer = in_encounter & (d_min < min_range)
+        min_range = np.where(closer, d_min, min_range)
+        t_min = np.where(closer, t0 + (t - t0)*s_min, t_min)
+        ending = in_encounter & (d_end >= self.range_m)
+
+        t_start = crossing(self.range_m, -1)
+        events = [EncounterEvent('start', float(t_start[p]),
+                                 self.vessel_ids[i[p]], self.vessel_ids[j[p]],
+                                 self.range_m)
+                  for p in np.flatnonzero(starting)]
+        for k, threshold in enumerate(self.thresholds_m):
+            breach = in_encounter & (n_breached <= k) & (d_min < threshold)
+            t_breach = crossing(threshold, -1)
+            events += [EncounterEvent('breach', float(t_breach[p]),
+                                      self.vessel_ids[i[p]],
+                                      self.vessel_ids[j[p]],
+                                      float(threshold))
+                       for p in np.flatnonzero(breach)]
+            n_breached = np.where(breach, k+1, n_breached)
+        t_end = crossing(self.range_m, 1)
+        events += [EncounterEvent('end', float(t_end[p]),
+                                  self.vessel_ids[i[p]], self.vessel_ids[j[p]],
+                                  self.range_m,
+                                  min_range_m=float(min_range[p]),
+                                  t_min_s=float(t_min[p]))
+                   for p in np.flatnonzero(ending)]
+
+        # The candidates are sorted by key, so the open encounters stay so
+        still_open = in_encounter & ~ending
+        self._keys = keys[still_open]
+        self._min_range = min_range[still_open]
+        self._t_min = t_min[still_open]
+        self._n_breached = n_breached[still_open]
+
+        events.sort(key=lambda e: e.t_s)
+        return events
+
+    def finish(self):
+        """Return end events for the encounters still open at the last
+        update, giving their minimum range so far, and forget them"""
+        events = []
+        for key, min_range, t_min in zip(self._keys, self._min_range,
+                                         self._t_min):
+            i, j = divmod(int(key), self.N)
+            events.append(EncounterEvent('end', float(self._t),
+                                         self.vessel_ids[i],
+                                         self.vessel_ids[j],
+                                         self.range_m,
+                                         min_range_m=float(min_range),
+                                         t_min_s=float(t_min)))
+        self.reset(self.vessel_ids)
+        return events
@@ -0,0 +1,442 @@
+import numpy as np
+from collections.abc import Mapping
+from mass_simulator.agent import Agent
+from mass_simulator.general import *
+from mass_simulator.spatial import find_neighbour_pairs
+from mass_simulator.history import History
+
+
+class Fleet():
+    """ Struct-of-arrays state for all of the vessels in an episode. The whole
+    fleet is advanced with one vectorised update per step and the vessels are
+    exposed as FleetAgent views so they behave like Agent objects.
+
+    If encounter_range_m is set, encounter metrics are only computed for pairs
+    of vessels that are within encounter_range_m of each other or could close
+    to that range within tcpa_horizon_s. The pairs are found with a uniform
+    grid over the vessel positions, and the other pairs are marked as out of
+    range.
+
+    The position history of the fleet is a History of (N, 2) items, bounded
+    by hist_max_len with hist_policy if given.
+    """
+
+    def __init__(self,
+                 vessels: dict,
+                 encounter_range_m: float = None,
+                 tcpa_horizon_s: float = 0.,
+                 hist_max_len: int = None,
+                 hist_policy: str = "ring"):
+        self.vessel_ids = list(vessels.keys())
+        self.index = {vessel_id: i for i, vessel_id
+                      in enumerate(self.vessel_ids)}
+        self.N = len(self.vessel_ids)
+
+        # Kinematic state, one row per vessel
+        self.xy = np.zeros((self.N, 2))
+        self.xy_step = np.zeros((self.N, 2))
+        self.course_deg = np.zeros(self.N)
+        self.speed_mps = np.zeros(self.N)
+        self.speed_kn = np.zeros(self.N)
+
+        # Waypoint progress. The waypoint lists themselves stay as python
+        # lists, only the current target is kept in an array
+        self.waypoints = [None]*self.N
+        self.goal_waypoint = [None]*self.N
+        self.waypoint_n = np.zeros(self.N, dtype=int)
+        self.n_waypoints = np.zeros(self.N, dtype=int)
+        self.target_xy = np.zeros((self.N, 2))
+        self.final_waypoint_reached = np.zeros(self.N, dtype=bool)
+
+        # Position history, and the positions before the last step for the
+        # waypoint arrival test
+        self.hist = History(item_shape=(self.N, 2),
+                            max_len=hist_max_len,
+                            policy=hist_policy)
+        self._xy_prev = np.zeros((self.N, 2))
+
+        # Pairwise encounter metrics, recomputed on demand after the state
+        # has changed
+        self.encounter_range_m = encounter_range_m
+        self.tcpa_horizon_s = tcpa_horizon_s
+        self._encounters = None
+        self._encounter_pairs = None
+
+        self._load(vessels)
+        self.agents = {vessel_id: FleetAgent(self, i)
+                       for i, vessel_id in enumerate(self.vessel_ids)}
+
+    def reset(self,
+              vessels: dict):
+        """Load the state of a new set of Agents with the same vessel ids in
+        place, reusing the arrays and the history buffer"""
+        if list(vessels.keys()) != self.vessel_ids:
+            raise ValueError("A Fleet can only be reset with the same " +
+                             "vessels.")
+        self.hist.clear()
+        self._invalidate_encounters()
+        self._load(vessels)
+
+    def _load(self, vessels):
+        v: Agent
+        for i, v in enumerate(vessels.values()):
+            self.xy[i] = v.xy[0:2]
+            self.xy_step[i] = v.xy_step
+            self.course_deg[i] = v.course_deg
+            self.speed_mps[i] = v.speed_mps
+            self.speed_kn[i] = v.speed_kn
+            self.waypoints[i] = v.waypoints
+            self.goal_waypoint[i] = v.goal_waypoint
+            self.waypoint_n[i] = v.waypoint_n
+            self.final_waypoint_reached[i] = v._final_waypoint_reached
+            self._update_target(i)
+        self.hist.append(self.xy)
+
+    def next_step(self,
+                  t_step):
+        self._xy_prev[:] = self.xy
+        self.xy += self.xy_step*t_step
+        self.hist.append(self.xy)
+        self._invalidate_encounters()
+
+        # Distance from each vessel's current waypoint to the path travelled
+        # over the last step
+        d = compute_perp_distances(self._xy_prev,
+                                   self.xy,
+                                   self.target_xy)
+        arrived = (self.waypoint_n < self.n_waypoints) & (d < 50)
+        for i in np.flatnonzero(arrived):
+            self._waypoint_reached(i)
+
+    def advance(self,
+                n_steps: int,
+                t_step):
+        """Advance every vessel n_steps steps in one update, without testing
+        for waypoint arrivals. Only valid when no vessel can arrive within
+        those steps, see steps_to_next_arrival. The history is filled in with
+        the same rounding as n_steps calls to next_step"""
+        if n_steps <= 0:
+            return
+        steps = np.empty((n_steps+1, self.N, 2))
+        steps[0] = self.xy
+        steps[1:] = self.xy_step*t_step
+        xy = np.cumsum(steps, axis=0)[1:]
+        self.hist.extend(xy)
+        self.xy[:] = xy[-1]
+        self._invalidate_encounters()
+
+    def steps_to_next_arrival(self, t_step):
+        """Return the number of steps until the first step on which a vessel
+        could reach its current waypoint, or inf if no vessel will. The
+        arrival test passes on the first step whose path comes within 50 m of
+        the waypoint"""
+        active = ~self.final_waypoint_reached & \
+            (self.waypoint_n < self.n_waypoints)
+        if not active.any():
+            return np.inf
+        t = compute_entry_times(self.xy[active],
+                                self.xy_step[active],
+                                self.target_xy[active],
+                                50).min()
+        return np.floor(t/t_step) + 1
+
+    def steps_to_range(self, range_m, t_step):
+        """Return the number of steps until the first step on which a pair of
+        vessels which is further than range_m apart comes within range_m, or
+        inf if none will"""
+        i, j = np.triu_indices(self.N, k=1)
+        dxy = self.xy[j] - self.xy[i]
+        outside = (dxy**2).sum(axis=1) > range_m**2
+        if not outside.any():
+            return np.inf
+        t = compute_entry_times(dxy[outside],
+                                (self.xy_step[j] - self.xy_step[i])[outside],
+                                np.zeros(2),
+                                range_m).min()
+        return np.ceil(t/t_step)
+
+    def steps_to_cpa(self, cpa_m, tcpa_max_s, t_step):
+        """Return the number of steps until the first step on which a pair of
+        vessels which will pass within cpa_m comes within tcpa_max_s of its
+        closest point of approach, or inf if none will. Moving in straight
+        lines the cpa of a pair doesn't change, so a pair can only start to
+        pass within cpa_m when a vessel changes course or speed"""
+        i, j = np.triu_indices(self.N, k=1)
+        cpa, tcpa = compute_encounters(self.xy[i], self.xy_step[i],
+                                       self.xy[j], self.xy_step[j])[0:2]
+        due = (cpa < cpa_m) & (tcpa > tcpa_max_s)
+        if not due.any():
+            return np.inf
+        return np.ceil((tcpa[due] - tcpa_max_s).min()/t_step)
+
+    def all_final_waypoints_reached(self):
+        return bool(self.final_waypoint_reached.all())
+
+    def _waypoint_reached(self, i):
+        if self.waypoint_n[i] < self.n_waypoints[i]-1:
+            self.waypoint_n[i] += 1
+            self._update_target(i)
+            self.set_course(i, compute_bearing(self.xy[i],
+                                               self.target_xy[i]))
+        else:
+            self.final_waypoint_reached[i] = True
+
+    def _update_target(self, i):
+        self.n_waypoints[i] = len(self.waypoints[i])
+        n = min(self.waypoint_n[i], self.n_waypoints[i]-1)
+        self.target_xy[i] = self.waypoints[i][n][0:2]
+
+    def _invalidate_encounters(self):
+        self._encounters = None
+        self._encounter_pairs = None
+
+    def get_encounters(self):
+        """Return the N x N cpa, tcpa, range and bearing matrices where
+        element [i, j] describes vessel j as seen from vessel i. With an
+        encounter range set, only the pairs from get_encounter_pairs are
+        computed and every metric of the other pairs is nan"""
+        if self._encounters is None:
+            if self.encounter_range_m is None:
+                self._encounters = compute_encounter_matrices(self.xy,
+                                                              self.xy_step)
+            else:
+                i, j = self.get_encounter_pairs()[0:2]
+                matrices = []
+                for metric in self.get_encounter_pairs()[2:6]:
+                    matrix = np.full((self.N, self.N), np.nan)
+                    matrix[i, j] = metric
+                    matrices.append(matrix)
+                self._encounters = tuple(matrices)
+        return self._encounters
+
+    def get_encounter_pairs(self):
+        """Return the pairs of vessels within the encounter range, or which
+        will close to it within tcpa_horizon_s, as the arrays i, j, cpa,
+        tcpa, range and bearing, sorted by i then j"""
+        if self._encounter_pairs is None:
+            # The grid search finds every pair which could be in range, which
+            # are then checked exactly
+            radius = self.encounter_range_m + \
+                2*self.speed_mps.max()*self.tcpa_horizon_s
+            i, j = find_neighbour_pairs(self.xy, radius)
+            t = compute_entry_times(self.xy[j] - self.xy[i],
+                                    self.xy_step[j] - self.xy_step[i],
+                                    np.zeros(2),
+                                    self.encounter_range_m)
+            keep = t <= self.tcpa_horizon_s
+            i, j = i[keep], j[keep]
+            cpa_m, tcpa_s, range_m, bearing_deg = \
+                compute_encounters(self.xy[i], self.xy_step[i],
+                                   self.xy[j], self.xy_step[j])
+            self._encounter_pairs = (i, j, cpa_m, tcpa_s, range_m,
+                                     bearing_deg, i*self.N + j)
+        return self._encounter_pairs[0:6]
+
+    def get_encounter(self, i, j):
+        """Return the cpa, tcpa, range and bearing of vessel j as seen from
+        vessel i, and whether the pair is within the encounter range"""
+        if self.encounter_range_m is None:
+            cpa_m, tcpa_s, range_m, bearing_deg = self.get_encounters()
+            return (cpa_m[i, j], tcpa_s[i, j], range_m[i, j],
+                    bearing_deg[i, j], True)
+
+        self.get_encounter_pairs()
+        keys = self._encounter_pairs[6]
+        n = np.searchsorted(keys, i*self.N + j)
+        if n < len(keys) and keys[n] == i*self.N + j:
+            return (*[p[n] for p in self._encounter_pairs[2:6]], True)
+
+        # Out of range, only the cheap metrics are computed
+        return (np.nan,
+                np.nan,
+                compute_distance(self.xy[i], self.xy[j]),
+                compute_bearing(self.xy[i], self.xy[j]),
+                False)
+
+    def set_course(self, i, course_deg):
+        self.course_deg[i] = course_deg
+        self._compute_xy_step(i)
+
+    def set_speed(self, i, speed_mps):
+        self.speed_mps[i] = speed_mps
+        self.speed_kn[i] = mps_to_kn(speed_mps)
+        self._compute_xy_step(i)
+
+    def _compute_xy_step(self, i):
+        course_rad = np.deg2rad(self.course_deg[i])
+        self.xy_step[i] = [self.speed_mps[i]*np.sin(course_rad),
+                           self.speed_mps[i]*np.cos(course_rad)]
+        self._invalidate_encounters()
+
+    def get_xy_hist(self, i):
+        return self.hist.column(i)
+
+
+class FleetAgent(Agent):
+    """ Thin Agent view onto one vessel of a Fleet. Attribute reads and writes
+    go straight to the fleet arrays so the Agent methods keep working.
+    """
+
+    def __init__(self,
+                 fleet: Fleet,
+                 i: int):
+        self._fleet = fleet
+        self._i = i
+        self.vessel_id = fleet.vessel_ids[i]
+        self.other_vessels = OtherVesselsView(fleet, i)
+
+    def next_step(self,
+                  t_step):
+        raise RuntimeError("Vessels in a Fleet are advanced together " +
+                           "with Fleet.next_step")
+
+    def update_other_vessels(self,
+                             other_vessels: dict):
+        # other_vessels is a view onto the fleet encounter matrices, which
+        # are kept up to date by the fleet
+        pass
+
+    def _compute_xy_step(self):
+        self._fleet._compute_xy_step(self._i)
+
+    def update_speed(self,
+                     speed_mps):
+        self._fleet.set_speed(self._i, speed_mps)
+
+    @property
+    def xy(self):
+        return self._fleet.xy[self._i].tolist()
+
+    @xy.setter
+    def xy(self, xy):
+        self._fleet.xy[self._i] = xy[0:2]
+        self._fleet._invalidate_encounters()
+
+    @property
+    def xy_hist(self):
+        return self._fleet.get_xy_hist(self._i)
+
+    @property
+    def xy_step(self):
+        return self._fleet.xy_step[self._i].tolist()
+
+    @property
+    def course_deg(self):
+        return self._fleet.course_deg[self._i]
+
+    @course_deg.setter
+    def course_deg(self, course_deg):
+        self._fleet.course_deg[self._i] = course_deg
+        self._fleet._invalidate_encounters()
+
+    @property
+    def speed_mps(self):
+        return self._fleet.speed_mps[self._i]
+
+    @property
+    def speed_kn(self):
+        return self._fleet.speed_kn[self._i]
+
+    @property
+    def waypoints(self):
+        return self._fleet.waypoints[self._i]
+
+    @waypoints.setter
+    def waypoints(self, waypoints):
+        self._fleet.waypoints[self._i] = waypoints
+        self._fleet._update_target(self._i)
+
+    @property
+    def waypoint_n(self):
+        return int(self._fleet.waypoint_n[self._i])
+
+    @waypoint_n.setter
+    def waypoint_n(self, waypoint_n):
+        self._fleet.waypoint_n[self._i] = waypoint_n
+        self._fleet._update_target(self._i)
+
+    @property
+    def goal_waypoint(self):
+        return self._fleet.goal_waypoint[self._i]
+
+    @goal_waypoint.setter
+    def goal_waypoint(self, goal_waypoint):
+        self._fleet.goal_waypoint[self._i] = goal_waypoint
+
+    @property
+    def _final_waypoint_reached(self):
+        return bool(self._fleet.final_waypoint_reached[self._i])
+
+
+class OtherVesselsView(Mapping):
+    """ Read-only mapping of the other vessels in a Fleet relative to vessel i,
+    used in place of the Agent.other_vessels dictionary.
+    """
+
+    def __init__(self,
+                 fleet: Fleet,
+                 i: int):
+        self._fleet = fleet
+        self._i = i
+
+    def __getitem__(self, vessel_id):
+        j = self._fleet.index[vessel_id]
+        if j == self._i:
+            raise KeyError(vessel_id)
+        return OtherVesselView(self._fleet, self._i, j)
+
+    def __iter__(self):
+        for j, vessel_id in enumerate(self._fleet.vessel_ids):
+            if j != self._i:
+                yield vessel_id
+
+    def __len__(self):
+        return self._fleet.N-1
+
+
+class OtherVesselView():
+    """ Lazy equivalent of OtherVessel reading the encounter metrics of vessel
+    j as seen from vessel i from the fleet.
+    """
+    __slots__ = ['_fleet', '_i', '_j']
+
+    def __init__(self,
+                 fleet: Fleet,
+                 i: int,
+                 j: int):
+        self._fleet = fleet
+        self._i = i
+        self._j = j
+
+    @property
+    def cpa_m(self):
+        return self._fleet.get_encounter(self._i, self._j)[0]
+
+    @property
+    def cpa_yds(self):
+        return m_to_yds(self.cpa_m)
+
+    @property
+    def tcpa_s(self):
+        return self._fleet.get_encounter(self._i, self._j)[1]
+
+    @property
+    def range_m(self):
+        return self._fleet.get_encounter(self._i, self._j)[2]
+
+    @property
+    def range_yds(self):
+        return m_to_yds(self.range_m)
+
+    @property
+    def bearing_deg(self):
+        return self._fleet.get_encounter(self._i, self._j)[3]
+
+    @property
+    def in_range(self):
+        return self._fleet.get_encounter(self._i, self._j)[4]
+
+    def __repr__(self):
+        return (f"OtherVesselView(cpa_m={self.cpa_m}, "
+                f"tcpa_s={self.tcpa_s}, range_m={self.range_m}, "
+                f"bearing_deg={self.bearing_deg})")
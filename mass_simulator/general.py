@@ -118,3 +118,102 @@ def compute_perp_distance(A,
         d = abs(x1 * y2 - y1 * x2) / mod
 
     return d
+
+
+def compute_perp_distances(A,
+                           B,
+                           E):
+    """Vectorised compute_perp_distance for arrays of points with shape 
+    (..., 2), one segment AB and point E per row"""
+    AB_x = B[..., 0] - A[..., 0]
+    AB_y = B[..., 1] - A[..., 1]
+    BE_x = E[..., 0] - B[..., 0]
+    BE_y = E[..., 1] - B[..., 1]
+    AE_x = E[..., 0] - A[..., 0]
+    AE_y = E[..., 1] - A[..., 1]
+
+    AB_BE = AB_x * BE_x + AB_y * BE_y
+    AB_AE = AB_x * AE_x + AB_y * AE_y
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = np.where(AB_BE > 0,
+                     np.sqrt(BE_x * BE_x + BE_y * BE_y),
+                     np.where(AB_AE < 0,
+                              np.sqrt(AE_x * AE_x + AE_y * AE_y),
+                              np.abs(AB_x * AE_y - AB_y * AE_x) /
+                              np.sqrt(AB_x * AB_x + AB_y * AB_y)))
+    return d
+
+
+def compute_encounters(xy1, xy_step1,
+                       xy2, xy_step2):
+    """Compute the cpa, tcpa, range and bearing of the vessels at xy2 as seen
+    from the vessels at xy1, given their velocities in xy_step1 and xy_step2.
+    The inputs have shape (..., 2) and are broadcast against each other"""
+    dx = xy1[..., 0] - xy2[..., 0]
+    dy = xy1[..., 1] - xy2[..., 1]
+    dv_x = xy_step1[..., 0] - xy_step2[..., 0]
+    dv_y = xy_step1[..., 1] - xy_step2[..., 1]
+
+    # CPA and TCPA, nan for vessels with the same velocity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dv_sq = dv_x**2 + dv_y**2
+        cpa_m = np.abs(dv_y*dx - dv_x*dy)/np.sqrt(dv_sq)
+        tcpa_s = np.maximum(- (dv_x*dx + dv_y*dy)/dv_sq, 0)
+
+    range_m = np.sqrt(dx**2 + dy**2)
+    bearing_deg = np.rad2deg(np.arctan2(-dx, -dy))
+    return cpa_m, tcpa_s, range_m, bearing_deg
+
+
+def compute_encounter_matrices(xy,
+                               xy_step):
+    """Compute the cpa, tcpa, range and bearing between every pair of vessels
+    from their positions and velocities with shape (..., N, 2). Element 
+    [..., i, j] describes vessel j as seen from vessel i"""
+    return compute_encounters(xy[..., :, None, :], xy_step[..., :, None, :],
+                              xy[..., None, :, :], xy_step[..., None, :, :])
+
+
+def compute_entry_times(xy,
+                        xy_step,
+                        centre,
+                        radius):
+    """Find the time at which points moving from xy with velocity xy_step
+    first come within radius of centre. The inputs have shape (..., 2). The
+    time is 0 for points already inside and inf for points which never enter"""
+    dx = xy[..., 0] - centre[..., 0]
+    dy = xy[..., 1] - centre[..., 1]
+    a = xy_step[..., 0]**2 + xy_step[..., 1]**2
+    b = dx*xy_step[..., 0] + dy*xy_step[..., 1]
+    c = dx**2 + dy**2 - radius**2
+
+    # Smaller root of a t^2 + 2 b t + c = 0, if the path crosses the circle
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (-b - np.sqrt(b**2 - a*c))/a
+    t = np.where((b**2 - a*c > 0) & (a > 0) & (t >= 0), t, np.inf)
+    return np.where(c < 0, 0., t)
+
+
+def simplify_polyline(xy,
+                      tol_m):
+    """Simplify a polyline, shape (n, 2), with the Douglas-Peucker algorithm
+    so that no dropped point is further than tol_m from the simplified line.
+    The end points are always kept"""
+    xy = np.asarray(xy)
+    if len(xy) < 3:
+        return xy
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[[0, -1]] = True
+    sections = [(0, len(xy)-1)]
+    while sections:
+        a, b = sections.pop()
+        if b - a < 2:
+            continue
+        d = compute_perp_distances(xy[a], xy[b], xy[a+1:b])
+        k = np.argmax(d)
+        if d[k] > tol_m:
+            keep[a+1+k] = True
+            sections.append((a, a+1+k))
+            sections.append((a+1+k, b))
+    return xy[keep]
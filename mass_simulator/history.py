@@ -0,0 +1,172 @@
+import numpy as np
+
+
+class History():
+    """ Array backed history of fixed shape items, such as the positions of a
+    vessel, shape (2,), or of a whole fleet, shape (N, 2).
+
+    Items are stored in a preallocated buffer which doubles when full, and
+    view() returns the stored items as an array without copying. With max_len
+    set, memory stays bounded. With the "ring" policy only the latest max_len
+    items are kept. The buffer holds two copies of the ring, so the kept items
+    are always contiguous and can still be viewed without copying. With the
+    "decimate" policy the whole history is kept at reduced resolution, and
+    every other item is dropped each time max_len is reached.
+    """
+
+    def __init__(self,
+                 item_shape: tuple = (2,),
+                 max_len: int = None,
+                 policy: str = "ring",
+                 capacity: int = 64):
+        if policy not in ["ring", "decimate"]:
+            raise ValueError(f"Unknown history policy {policy}. " +
+                             "Must be either 'ring' or 'decimate'.")
+        if max_len is not None and max_len < 2:
+            raise ValueError("max_len must be at least 2.")
+        self.item_shape = tuple(item_shape)
+        self.max_len = max_len
+        self.policy = policy
+        if max_len is not None:
+            capacity = 2*max_len if policy == "ring" else max_len
+        self._buf = np.zeros((capacity,) + self.item_shape)
+        self._start = 0
+        self._n = 0
+
+        # Number of items ever appended. Decimation keeps one in every stride
+        self.stride = 1
+        self.count = 0
+
+    def clear(self):
+        """Empty the history, keeping the buffer"""
+        self._start = 0
+        self._n = 0
+        self.stride = 1
+        self.count = 0
+
+    def append(self, item):
+        self.count += 1
+        if self.policy == "decimate" and (self.count-1) % self.stride:
+            return
+        if self.max_len is None:
+            if self._n == len(self._buf):
+                self._grow(self._n+1)
+            self._buf[self._n] = item
+            self._n += 1
+        elif self.policy == "ring":
+            # Write to both copies of the ring
+            i = (self._start + self._n) % self.max_len
+            self._buf[i] = item
+            self._buf[i+self.max_len] = item
+            if self._n < self.max_len:
+                self._n += 1
+            else:
+                self._start = (self._start + 1) % self.max_len
+        else:
+            if self._n == self.max_len:
+                self._decimate()
+                if (self.count-1) % self.stride:
+                    return
+            self._buf[self._n] = item
+            self._n += 1
+
+    def extend(self, items):
+        items = np.asarray(items)
+        if self.max_len is None:
+            if self._n + len(items) > len(self._buf):
+                self._grow(self._n + len(items))
+            self._buf[self._n:self._n+len(items)] = items
+            self._n += len(items)
+            self.count += len(items)
+        elif self.policy == "ring" and len(items) >= self.max_len:
+            # Only the last max_len items are kept
+            self._buf[:self.max_len] = items[-self.max_len:]
+            self._buf[self.max_len:] = items[-self.max_len:]
+            self._start = 0
+            self._n = self.max_len
+            self.count += len(items)
+        else:
+            for item in items:
+                self.append(item)
+
+    def _grow(self, n):
+        capacity = len(self._buf)
+        while capacity < n:
+            capacity *= 2
+        buf = np.zeros((capacity,) + self.item_shape)
+        buf[:self._n] = self._buf[:self._n]
+        self._buf = buf
+
+    def _decimate(self):
+        kept = self._buf[0:self._n:2].copy()
+        self._buf[:len(kept)] = kept
+        self._n = len(kept)
+        self.stride *= 2
+
+    def view(self):
+        """Return the stored items, oldest first, without copying"""
+        return self._buf[self._start:self._start+self._n]
+
+    def since(self, count: int):
+        """Return a view of the stored items appended after the first count
+        items, for consumers which follow the history incrementally"""
+        if self.policy == "decimate" and self.max_len is not None:
+            first = -(-count // self.stride)
+        else:
+            first = count - (self.count - self._n)
+        return self.view()[max(first, 0):]
+
+    def column(self, i: int):
+        """Return the history of item column i, such as one vessel of a
+        fleet history"""
+        return HistoryColumn(self, i)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.view()
+        return self.view().astype(dtype)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
+
+
+class HistoryColumn():
+    """ History of one column of the items of a History, with the same read
+    interface.
+    """
+
+    def __init__(self,
+                 history: History,
+                 i: int):
+        self.history = history
+        self.i = i
+
+    @property
+    def count(self):
+        return self.history.count
+
+    def view(self):
+        return self.history.view()[:, self.i]
+
+    def since(self, count: int):
+        return self.history.since(count)[:, self.i]
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.view()
+        return self.view().astype(dtype)
+
+    def __len__(self):
+        return len(self.history)
+
+    def __getitem__(self, key):
+        return self.view()[key]
+
+    def __iter__(self):
+        return iter(self.view())
@@ -0,0 +1,217 @@
+import json
+import mmap
+import bisect
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from mass_simulator.columnar import LogReader, STATE_FIELDS
+from mass_simulator.logger import INDEX_SUFFIX
+
+
+class ChunkedLogReader(LogReader, ABC):
+    """ Base class for logs which are decoded in chunks of steps when they
+    are needed. Subclasses set the times, vessels and the first step of each
+    chunk, then implement _decode_chunk to fill in the state array.
+
+    A background thread decodes the prefetch chunks ahead of the playback
+    position in the direction of play. Once the window around the playback
+    position is decoded, the thread fills in the other chunks if backfill is
+    set so that the vessel histories are complete. Otherwise only the chunks
+    played through are decoded, and the steps of the others are nan.
+    """
+
+    def _start(self,
+               chunk_starts,
+               prefetch: int,
+               backfill: bool):
+        self.state = np.full((len(self.time), len(self.vessel_ids),
+                              len(STATE_FIELDS)),
+                             np.nan)
+        self._vessel_index = {vessel_id: i for i, vessel_id
+                              in enumerate(self.vessel_ids)}
+        self._chunk_starts = list(chunk_starts)
+        self._n_chunks = len(self._chunk_starts)
+        self.n_prefetch = prefetch
+        self.backfill = backfill
+
+        # Per chunk waypoint changes and other entries, filled in as the
+        # chunks are decoded
+        self._chunk_waypoints = {}
+        self._chunk_extras = {}
+        self._lock = threading.Lock()
+
+        # Background prefetching
+        self._target = (0, 1)
+        self._closed = False
+        self._wake = threading.Condition()
+        self._thread = threading.Thread(target=self._prefetch_loop,
+                                        daemon=True)
+        self._thread.start()
+
+    def _get_chunk(self, n):
+        return max(bisect.bisect_right(self._chunk_starts, n)-1, 0)
+
+    def _get_chunk_end(self, c):
+        if c+1 < self._n_chunks:
+            return self._chunk_starts[c+1]
+        return len(self.time)
+
+    @abstractmethod
+    def _decode_chunk(self, c):
+        """Fill in the state of the steps in chunk c and return the waypoint
+        changes, {vessel_id: ([n], [waypoints])}, and the other entries of
+        each step, {n: {key: value}}"""
+
+    def _load_chunk(self, c):
+        with self._lock:
+            if c not in self._chunk_waypoints:
+                waypoint_changes, extras = self._decode_chunk(c)
+                self._chunk_extras[c] = extras
+                self._chunk_waypoints[c] = waypoint_changes
+
+    def load(self, n):
+        self._load_chunk(self._get_chunk(n))
+
+    def load_all(self):
+        for c in range(self._n_chunks):
+            self._load_chunk(c)
+
+    def prefetch(self, n, direction: int = 1):
+        with self._wake:
+            self._target = (self._get_chunk(n), 1 if direction >= 0 else -1)
+            self._wake.notify()
+
+    def _get_next_chunk(self):
+        c, direction = self._target
+        wanted = [c + direction*k for k in range(self.n_prefetch+1)]
+        if self.backfill:
+            wanted += list(range(c-1, -1, -1)) + \
+                list(range(c+1, self._n_chunks))
+        for c_n in wanted:
+            if 0 <= c_n < self._n_chunks and \
+                    c_n not in self._chunk_waypoints:
+                return c_n
+        return None
+
+    def _prefetch_loop(self):
+        while True:
+            with self._wake:
+                while not self._closed:
+                    c = self._get_next_chunk()
+                    if c is not None:
+                        break
+                    self._wake.wait()
+                if self._closed:
+                    return
+            self._load_chunk(c)
+
+    def get_waypoints(self, vessel_id, n):
+        n_changes, waypoints = \
+            self._chunk_waypoints[self._get_chunk(n)][vessel_id]
+        return waypoints[max(bisect.bisect_right(n_changes, n)-1, 0)]
+
+    def get_extras(self, n):
+        self.load(n)
+        return self._chunk_extras[self._get_chunk(n)].get(n, {})
+
+    def close(self):
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+
+
+class LazyLogReader(ChunkedLogReader):
+    """ Lazy reader for ndjson logs. Opening the log only reads the index the
+    Logger saved alongside it, of where each line ends and the time of each
+    step. Logs without one, such as those cut short by a crash, are scanned
+    for the line ends instead and the time read from the start of each
+    record. The steps are then decoded in chunks of chunk_size.
+    """
+
+    def __init__(self,
+                 log_file,
+                 chunk_size: int = 64,
+                 prefetch: int = 8,
+                 backfill: bool = False):
+        self._f = open(log_file, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Line start offsets. The first line is the setup, and a last line
+        # without a newline was cut short by a crash so is ignored
+        index = self._load_index(log_file)
+        line_ends = index[0] if index else self._find_line_ends()
+        self._starts = np.concatenate([[0], line_ends[:-1]+1])
+        self._ends = line_ends
+        self.setup = json.loads(self._mm[0:self._ends[0]])['setup']
+        self._starts = self._starts[1:]
+        self._ends = self._ends[1:]
+
+        if index:
+            self.time = index[1][1:]
+        else:
+            self.time = np.array([self._read_time(n)
+                                  for n in range(len(self._starts))])
+        self.vessel_ids = [v['vessel'] for v in self.setup['vessel_details']]
+        self._start(range(0, len(self.time), chunk_size),
+                    prefetch,
+                    backfill)
+
+    def _load_index(self, log_file):
+        # The line ends and times saved by the Logger, if they match the file
+        try:
+            with np.load(log_file + INDEX_SUFFIX) as f:
+                ends, time = f['ends'], f['time']
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(ends) == 0 or len(time) != len(ends) or \
+                ends[-1] + 1 != len(self._mm):
+            return None
+        return ends, time
+
+    def _find_line_ends(self):
+        # Scan the file for newlines in blocks to bound the memory used
+        block = 1 << 24
+        line_ends = []
+        buf = np.frombuffer(self._mm, dtype=np.uint8)
+        for start in range(0, len(buf), block):
+            line_ends.append(np.flatnonzero(buf[start:start+block] ==
+                                            ord("\n")) + start)
+        del buf
+        return np.concatenate(line_ends)
+
+    def _read_time(self, n):
+        # Records start with {"time":<t>, so the time can be read without
+        # decoding the rest of the line
+        head = self._mm[self._starts[n]:min(self._starts[n]+64,
+                                            self._ends[n])]
+        if head.startswith(b'{"time":'):
+            return float(head[8:head.index(b',')])
+        return json.loads(self._mm[self._starts[n]:self._ends[n]])['time']
+
+    def _decode_chunk(self, c):
+        waypoint_changes = {}
+        extras = {}
+        for n in range(self._chunk_starts[c], self._get_chunk_end(c)):
+            step = json.loads(self._mm[self._starts[n]:self._ends[n]])
+            for v in step['vessels']:
+                i = self._vessel_index.get(v['vessel_id'])
+                if i is None:
+                    continue
+                self.state[n, i] = [v['xy'][0], v['xy'][1],
+                                    v['course_deg'], v['speed_mps']]
+                n_changes, waypoints = waypoint_changes.setdefault(
+                    v['vessel_id'], ([], []))
+                if not waypoints or waypoints[-1] != v['waypoints']:
+                    n_changes.append(n)
+                    waypoints.append(v['waypoints'])
+            for key in step:
+                if key not in ['time', 'vessels']:
+                    extras.setdefault(n, {})[key] = step[key]
+        return waypoint_changes, extras
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._mm.close()
+            self._f.close()
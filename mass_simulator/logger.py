@@ -1,22 +1,99 @@
 import os
+import numpy as np
 from mass_simulator.agent import Agent
+from mass_simulator.columnar import ColumnarLog
 import json
 
+# File extension of each of the log formats
+LOG_EXTENSIONS = {"json": ".json",
+                  "ndjson": ".ndjson",
+                  "npz": ".npz",
+                  "commands": ".cmdlog"}
+
+# Added to the path of an ndjson log for its index of where each line ends
+# and the time of each step, written when the log is saved
+INDEX_SUFFIX = ".idx"
+
 
 class Logger():
     """ Logger class for the MASS simulator
+
+    With log_format "json" the whole episode is kept in memory and written at
+    save_log_file(). With "ndjson" the log is streamed to disk as it goes, one
+    line for the setup followed by one line per step, so memory use stays
+    bounded and a crash only loses the steps since the last flush. The file is
+    flushed every flush_every steps, and also synced to disk if fsync is set.
+    Saving also writes an index of the lines, so the log opens without being
+    scanned.
+    With "npz" the vessel states are kept in arrays and written as a columnar
+    log, in single precision if float32 is set. With "commands" only the
+    setup, the waypoint, speed and course commands and a keyframe of the full
+    vessel state every keyframe_every steps are streamed to disk, and
+    Playback re-simulates the steps between keyframes.
     """
 
     def __init__(self,
                  save_dir,
-                 scen_conf):
-        self.save_path = self._get_next_file_name(save_dir)
+                 scen_conf,
+                 log_format: str = "json",
+                 flush_every: int = 100,
+                 fsync: bool = False,
+                 float32: bool = False,
+                 keyframe_every: int = 100):
+        if log_format not in LOG_EXTENSIONS:
+            raise ValueError(f"Unknown log format {log_format}. Must be " +
+                             f"one of {list(LOG_EXTENSIONS.keys())}.")
+        self.log_format = log_format
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.keyframe_every = keyframe_every
+        self.float32 = float32
+        self.save_dir = save_dir
+        self._log_i = 0
+        self._f = None
+        self._saved = True
+        self.reset(scen_conf)
+
+    def reset(self,
+              scen_conf: dict = None):
+        """Start a new log in the next free file, for the scenario scen_conf
+        or the same scenario as before. The current log is saved first if it
+        hasn't been"""
+        if not self._saved:
+            self.save_log_file()
+        if self._f is not None:
+            self._f.close()
+        if scen_conf is None:
+            scen_conf = self.log_dict['setup']
+        # A log without any steps is started again in the same file
+        if self._log_i == 0 or self.n >= 0:
+            self.save_path = self._get_next_file_name(self.save_dir)
 
         # Initialise the log dictionary
         self.log_dict = {}
         self.log_dict['setup'] = scen_conf
         self.log_dict['log'] = []
         self.n = -1
+        self._step = None
+        self._pending = None
+        self._f = None
+        self._t = None
+        self._step_events = []
+
+        if self.log_format == "ndjson":
+            # An index left by an earlier log of the same name is out of date
+            if os.path.exists(self.save_path + INDEX_SUFFIX):
+                os.remove(self.save_path + INDEX_SUFFIX)
+            self._offset = 0
+            self._index = []
+            self._f = open(self.save_path, 'w')
+            self._write_line({'setup': scen_conf})
+        elif self.log_format == "npz":
+            self._columnar = ColumnarLog(scen_conf, float32=self.float32)
+        elif self.log_format == "commands":
+            self._f = open(self.save_path, 'w')
+            self._write_line({'setup': scen_conf,
+                              'keyframe_every': self.keyframe_every})
 
     def _get_next_file_name(self,
                             save_dir):
@@ -25,49 +102,175 @@ class Logger():
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
 
-        # find the next file name
-        i = 0
-        while os.path.exists(os.path.join(save_dir,
-                                          f"log_{i}.json")):
+        # find the next file name not used by a log of any format, carrying
+        # on from the last one this logger used
+        i = self._log_i
+        while any(os.path.exists(os.path.join(save_dir, f"log_{i}{ext}"))
+                  for ext in LOG_EXTENSIONS.values()):
             i += 1
-        return os.path.join(save_dir, f"log_{i}.json")
+        self._log_i = i + 1
+        return os.path.join(save_dir,
+                            f"log_{i}{LOG_EXTENSIONS[self.log_format]}")
 
     def add_speed_req(self,
                       speed_req):
-        self.log_dict['log'][self.n]['speed_req'] = speed_req
+        self._add_entry('speed_req', speed_req)
 
     def add_course_req(self,
                        course_req):
-        self.log_dict['log'][self.n]['course_req'] = course_req
+        self._add_entry('course_req', course_req)
 
     def add_waypoint_req(self,
                          wp_req):
-        self.log_dict['log'][self.n]['wp_req'] = wp_req
+        self._add_entry('wp_req', wp_req)
+
+    def _add_entry(self, key, value):
+        if self.log_format == "npz":
+            self._columnar.add_extra(key, value)
+        elif self.log_format == "commands":
+            self._write_pending()
+            self._write_line({'extra': key,
+                              'n': self.n,
+                              'value': value})
+        else:
+            self._step[key] = value
+
+    def log_command(self,
+                    command: str,
+                    vessel_id,
+                    value):
+        """Record a 'waypoints', 'speed' or 'course' command given to a
+        vessel after the current step. Only command logs store them, as the
+        other formats record the full state of every step"""
+        if self.log_format != "commands":
+            return
+        self._write_pending()
+        self._write_line({'command': command,
+                          'n': self.n,
+                          'vessel_id': vessel_id,
+                          'value': value})
 
     def log_vessel(self,
                    vessel: Agent):
+        if self.log_format == "npz":
+            self._columnar.add_vessel(vessel.vessel_id,
+                                      vessel.xy,
+                                      vessel.course_deg,
+                                      vessel.speed_mps,
+                                      vessel.waypoints)
+            return
+        elif self.log_format == "commands":
+            # only the keyframes contain the vessel states
+            if self._step is not None:
+                self._step['vessels'].append(
+                    {'vessel_id': vessel.vessel_id,
+                     'xy': vessel.xy,
+                     'course_deg': vessel.course_deg,
+                     'speed_kn': vessel.speed_kn,
+                     'speed_mps': vessel.speed_mps,
+                     'waypoints': vessel.waypoints,
+                     'waypoint_n': vessel.waypoint_n,
+                     'final_waypoint_reached':
+                     vessel._final_waypoint_reached})
+            return
         # add the agent position
-        self.log_dict['log'][self.n]['vessels'].append({'vessel_id': vessel.vessel_id,
-                                                        'xy': vessel.xy,
-                                                        'course_deg': vessel.course_deg,
-                                                        'speed_kn': vessel.speed_kn,
-                                                        'speed_mps': vessel.speed_mps,
-                                                        'waypoints': vessel.waypoints})
+        self._step['vessels'].append({'vessel_id': vessel.vessel_id,
+                                      'xy': vessel.xy,
+                                      'course_deg': vessel.course_deg,
+                                      'speed_kn': vessel.speed_kn,
+                                      'speed_mps': vessel.speed_mps,
+                                      'waypoints': vessel.waypoints})
 
     def next_step(self, t):
-        self.log_dict['log'].append({"vessels": []})
         self.n += 1
-        self.log_dict['log'][self.n]['time'] = t
+        self._saved = False
+        self._step_events = []
+        if self.log_format == "npz":
+            self._columnar.next_step(t)
+            return
+        elif self.log_format == "commands":
+            self._t = t
+            self._step = None
+            if self.n % self.keyframe_every == 0:
+                self._step = {'keyframe': self.n,
+                              'time': t,
+                              'vessels': []}
+            self._write_step()
+            return
+        self._step = {'time': t,
+                      'vessels': []}
+        if self.log_format == "ndjson":
+            self._write_step()
+        else:
+            self.log_dict['log'].append(self._step)
+
+    def _write_step(self):
+        # Write the previous step, which is complete once the next one starts
+        self._write_pending()
+        if self.n % self.flush_every == 0:
+            self._flush()
+        self._pending = self._step
+
+    def _write_pending(self):
+        if self._pending is not None:
+            self._write_line(self._pending)
+            self._pending = None
+
+    def _write_line(self, record):
+        if self._f is None:
+            self._f = open(self.save_path, 'a')
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        self._f.write(line)
+        if self.log_format == "ndjson":
+            # The lines are ASCII, so the characters are the bytes
+            self._offset += len(line)
+            self._index.append((self._offset - 1, record.get('time', np.nan)))
+
+    def _flush(self):
+        if self._f is None:
+            return
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
 
     def add_termination_reason(self,
                                termination_reason: str):
-        self.log_dict['log'][self.n]['termination_reason'] = termination_reason
+        self._add_entry('termination_reason', termination_reason)
 
     def add_performance_score(self,
                               perf_summary):
-        self.log_dict['log'][self.n]['performance_summary'] = perf_summary
+        self._add_entry('performance_summary', perf_summary)
+
+    def add_events(self,
+                   events: list):
+        # Events can be added more than once in a step, so the entry is
+        # replaced by all of the step's events so far
+        self._step_events = self._step_events + events
+        self._add_entry('events', self._step_events)
+
+    def add_perf_stats(self,
+                       perf_stats):
+        self._add_entry('perf_stats', perf_stats)
 
     def save_log_file(self):
+        self._saved = True
+        if self.log_format in ["ndjson", "commands"]:
+            # write the step in progress and close the file
+            self._write_pending()
+            if self.log_format == "commands":
+                self._write_line({'end': self.n,
+                                  'time': self._t})
+            if self._f is not None:
+                self._flush()
+                self._f.close()
+                self._f = None
+            if self.log_format == "ndjson":
+                self._save_index()
+            return
+        elif self.log_format == "npz":
+            self._columnar.save(self.save_path)
+            return
+
         # write the test dictionary to the file
         with open(self.save_path, 'w') as f:
             # write the dict to a json file
@@ -75,5 +278,39 @@ class Logger():
                       f,
                       indent=4)
 
-    def reset(self):
-        pass
+    def close(self):
+        """Save the log if it hasn't been, which for the streamed formats
+        writes the step in progress and closes the file"""
+        if not self._saved:
+            self.save_log_file()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def __del__(self):
+        # A streamed log which is never saved is left ending in a whole line
+        # rather than holding its file open. Nothing else is written, as
+        # saving may not be possible while the interpreter shuts down
+        f = getattr(self, '_f', None)
+        if f is not None and not f.closed:
+            try:
+                self._write_pending()
+                f.close()
+            except Exception:
+                pass
+
+    def _save_index(self):
+        ends, time = zip(*self._index)
+        # Written through a file object so np.savez doesn't add .npz, which
+        # would make it look like a log
+        with open(self.save_path + INDEX_SUFFIX, 'wb') as f:
+            np.savez(f,
+                     ends=np.array(ends, dtype=np.int64),
+                     time=np.array(time, dtype=float))
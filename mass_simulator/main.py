@@ -1,13 +1,17 @@
 from mass_simulator.agent import Agent
+from mass_simulator.fleet import Fleet
+from mass_simulator.history import History
 from mass_simulator.world import World
-from mass_simulator.plotter import Plotter
-from mass_simulator.logger import Logger
+from mass_simulator.logger import Logger, LOG_EXTENSIONS
 from mass_simulator.playback import Playback
+from mass_simulator.pacing import Pacer
+from mass_simulator.profiling import Profiler
+from mass_simulator.events import EncounterDetector
+from mass_simulator.scenario import compile_scenario
 import os
 import json
+from dataclasses import asdict
 from mass_simulator.general import *
-import pyproj
-from time import time
 
 
 class MASSsim():
@@ -16,9 +20,43 @@ class MASSsim():
                  mode: str = "manual",
                  plotter: bool = True,
                  log_dir: str = "logs/",
-                 log_file: int | str = ""):
+                 log_file: int | str = "",
+                 log_format: str = "json",
+                 log_flush_every: int = 100,
+                 log_fsync: bool = False,
+                 log_float32: bool = False,
+                 engine: str = "agent",
+                 encounter_range_m: float = None,
+                 tcpa_horizon_s: float = 0.,
+                 hist_max_len: int = None,
+                 hist_policy: str = "ring",
+                 target_fps: float = 60.,
+                 profile: bool = False,
+                 event_range_m: float = None,
+                 event_thresholds_m: list = ()):
 
         self.termination_reason = ""
+        self.rng = np.random.default_rng()
+        if engine not in ["agent", "fleet"]:
+            raise ValueError(f"Unknown engine {engine}. " +
+                             "Must be either 'agent' or 'fleet'.")
+        if encounter_range_m is not None and engine != "fleet":
+            raise ValueError("encounter_range_m is only supported by " +
+                             "the 'fleet' engine.")
+        self._engine = engine
+        self._log_format = log_format
+        self._log_options = {'flush_every': log_flush_every,
+                             'fsync': log_fsync,
+                             'float32': log_float32}
+        self._encounter_range_m = encounter_range_m
+        self._tcpa_horizon_s = tcpa_horizon_s
+        self._hist_max_len = hist_max_len
+        self._hist_policy = hist_policy
+        self._target_fps = target_fps
+        self._profiler = Profiler() if profile else None
+        self._event_range_m = event_range_m
+        self._event_thresholds_m = event_thresholds_m
+        self._events = []
 
         if mode == "manual":
             self._start_manual(scenario=scenario,
@@ -31,59 +69,106 @@ class MASSsim():
             self._start_playback(log_file=log_file)
 
     def _start_manual(self, scenario, log_dir):
-        conf = self._get_scenario(scenario=scenario)
+        conf = self._conf = self._get_scenario(scenario=scenario)
         scen_conf, params, self._vessels, xy_lim = self._setup_scene(conf)
+        self._setup_engine()
         self._world = World(params['t_step'])
-        self._logger = Logger(log_dir, scen_conf)
+        self._logger = Logger(log_dir,
+                              scen_conf,
+                              log_format=self._log_format,
+                              **self._log_options)
+        Plotter = _get_plotter_class()
         self._plotter = Plotter(self._vessels,
                                 xy_lim,
                                 control=True)
+        self._setup_events()
+        self._instrument()
         self._manual_plotter_loop()
 
     def _start_test(self, scenario, log_dir, plotter):
-        conf = self._get_scenario(scenario=scenario)
+        conf = self._conf = self._get_scenario(scenario=scenario)
         scen_conf, params, self._vessels, xy_lim = self._setup_scene(conf)
+        self._setup_engine()
         self._world = World(params['t_step'])
-        self._logger = Logger(log_dir, scen_conf)
+        # Without a log directory nothing is logged
+        if log_dir is not None:
+            self._logger = Logger(log_dir,
+                                  scen_conf,
+                                  log_format=self._log_format,
+                                  **self._log_options)
         if plotter:
+            Plotter = _get_plotter_class()
             self._plotter = Plotter(self._vessels,
                                     xy_lim,
                                     control=False)
+        self._setup_events()
+        self._instrument()
+
+    def _setup_engine(self):
+        # With the fleet engine, the vessels become views onto the fleet arrays
+        if self._engine == "fleet":
+            self._fleet = Fleet(self._vessels,
+                                encounter_range_m=self._encounter_range_m,
+                                tcpa_horizon_s=self._tcpa_horizon_s,
+                                hist_max_len=self._hist_max_len,
+                                hist_policy=self._hist_policy)
+            self._vessels = self._fleet.agents
+        elif self._hist_max_len is not None:
+            v: Agent
+            for v in self._vessels.values():
+                xy_hist = History(max_len=self._hist_max_len,
+                                  policy=self._hist_policy)
+                xy_hist.extend(v.xy_hist.view())
+                v.xy_hist = xy_hist
 
     def _start_playback(self,
                         log_file):
         log_path = self._get_log_path(log_file=log_file)
         self._playback = Playback(log_file=log_path)
+        self._playback_n = None
         conf = self._playback.get_setup()
         scen_conf, params, self._vessels, xy_lim = self._setup_scene(conf)
         self._world = World(params['t_step'])
+        Plotter = _get_plotter_class()
         self._plotter = Plotter(self._vessels,
                                 xy_lim,
                                 control=True)
         self._plotter.add_time_scrubber(self._playback.t_max)
+        self._instrument()
         self._playback_plotter_loop()
+        self._playback.close()
 
     def _manual_plotter_loop(self):
-        t_0 = time()
+        self._pacer = pacer = Pacer(self._world.t_step,
+                                    target_fps=self._target_fps)
         while self._is_plotter_running():
+            pacer.start_frame()
             play = self._plotter.play
             if play:
-                if self._is_episode_running():
-                    if time() - t_0 >= self._world.t_step/(self._plotter.playspeed):
-                        self._manualtest_next_step()
-                        t_0 = time()
-                else:
+                # Run the steps due since the last frame, within the budget
+                for _ in range(pacer.steps_due(self._plotter.playspeed)):
+                    if not self._is_episode_running():
+                        break
+                    self._manualtest_next_step()
+                    pacer.add_steps(1)
+                    if not pacer.within_budget():
+                        break
+                if not self._is_episode_running():
                     self._plotter.set_play(False)
+            else:
+                pacer.pause()
             self._update_plotter()
+            pacer.wait()
 
         # When finished, save and tidy up
         if hasattr(self, "_logger"):
-            self._logger.save_log_file()
+            self._save_log()
 
     def _playback_plotter_loop(self):
-        t_0 = time()
+        self._pacer = pacer = Pacer(self._world.t_step,
+                                    target_fps=self._target_fps)
         while self._is_plotter_running():
-            # do stuff
+            pacer.start_frame()
             play = self._plotter.play
             t = self._plotter.get_time()
             t_n = np.clip(t-1, 0, self._playback.N)
@@ -92,15 +177,19 @@ class MASSsim():
 
             if play:
                 if self._is_episode_running():
-                    if time() - t_0 > self._world.t_step/(self._plotter.playspeed):
-                        self._playback_next_step()
-                        t_0 = time()
+                    # Jump straight to the step due, only the frame is drawn
+                    n_steps = pacer.steps_due(self._plotter.playspeed)
+                    if n_steps:
+                        self._playback_next_step(n_steps)
+                        pacer.add_steps(n_steps)
                 else:
                     self._plotter.set_play(False)
             else:
+                pacer.pause()
                 self._playback_n_step()
 
             self._update_plotter()
+            pacer.wait()
 
     def _playback_n_step(self):
         v: Agent
@@ -108,7 +197,12 @@ class MASSsim():
         self._plotter.set_time(t)
         self._playback.set_t(t)
         self._world.set_t(t)
+        # Nothing to update while paused on the same step
+        if self._playback.n == self._playback_n:
+            return
+        self._playback_n = self._playback.n
         t, self._vessels = self._playback.get_current_step()
+        self._instrument()
         for v in self._vessels.values():
             v.update_other_vessels(self._vessels)
 
@@ -123,6 +217,8 @@ class MASSsim():
     def _is_episode_running(self):
         if not hasattr(self, '_playback'):
             # Check if all vessels have reached their final waypoint
+            if hasattr(self, '_fleet'):
+                return not self._fleet.all_final_waypoints_reached()
             v: Agent
             reached = []
             for v in self._vessels.values():
@@ -145,25 +241,131 @@ class MASSsim():
             self._plotter.tidy_up()
         return self._is_episode_running()
 
+    def reset(self,
+              scenario: int | str | dict = None,
+              seed: int = None):
+        """Start a new test mode episode of the same scenario, or of a new
+        one. The vessels are restored to their initial conditions in place
+        when the scenario has the same vessels, and the scenario setup comes
+        from the scenario cache. The log is saved if it hasn't been and a new
+        one started. seed reseeds rng, the random generator for controllers
+        and perturbations. Returns the observations"""
+        if hasattr(self, '_playback'):
+            raise ValueError("Only test mode episodes can be reset.")
+        # The encounters still open end with the episode. Their end events
+        # are kept for get_events, and logged if the log is still open
+        if hasattr(self, '_detector'):
+            events = self._detector.finish()
+            if hasattr(self, '_logger') and not self._logger._saved:
+                self._add_events(events)
+            else:
+                self._events += events
+        if scenario is not None:
+            self._conf = self._get_scenario(scenario=scenario)
+        scenario = compile_scenario(self._conf)
+
+        if scenario.vessel_ids == list(self._vessels.keys()):
+            if hasattr(self, '_fleet'):
+                self._fleet.reset(scenario.make_vessels())
+            else:
+                scenario.reset_vessels(self._vessels)
+        else:
+            # Different vessels, so start again with new ones
+            self._vessels = scenario.make_vessels()
+            if hasattr(self, '_fleet'):
+                del self._fleet
+            self._setup_engine()
+            if hasattr(self, '_plotter'):
+                self._plotter.tidy_up()
+                Plotter = _get_plotter_class()
+                self._plotter = Plotter(self._vessels,
+                                        list(scenario.xy_lim),
+                                        control=False)
+
+        self._world.t_step = scenario.params['t_step']
+        self._world.set_t(0)
+        if hasattr(self, '_logger'):
+            if not self._logger._saved:
+                self._save_log()
+            self._logger.reset(self._conf)
+        self.termination_reason = ""
+        self._setup_events()
+        if self._profiler is not None:
+            self._profiler.reset()
+            self._instrument()
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        if hasattr(self, '_plotter'):
+            if self._is_plotter_running():
+                self._update_plotter()
+        return self.get_obs()
+
     def save_episode(self):
+        if hasattr(self, '_logger'):
+            self._save_log()
+
+    def _save_log(self):
+        # The profile of the episode goes in the log with the last step
+        if self._profiler is not None and self._logger.n >= 0:
+            self._logger.add_perf_stats(self.get_perf_stats())
         self._logger.save_log_file()
 
-    def _manualtest_next_step(self):
-        self._world.next_step()
+    def close(self):
+        """Save the episode log if it hasn't been and close its file. A
+        MASSsim can also be used as a context manager, which closes it at
+        the end of the block"""
         if hasattr(self, '_logger'):
-            self._logger.next_step(self._world.t_elapsed)
+            if not self._logger._saved:
+                self._save_log()
+            self._logger.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def get_log_path(self):
+        if not hasattr(self, '_logger'):
+            return None
+        return self._logger.save_path
+
+    def _manualtest_next_step(self, k_skip: int = 0):
+        # A single step, used by next_step and every run method. With the
+        # fleet engine, k_skip steps in a straight line are skipped over
+        # first, and only the step itself is logged
+        world = self._world
+        logger = getattr(self, '_logger', None)
+        fleet = getattr(self, '_fleet', None)
+        if k_skip:
+            fleet.advance(k_skip, world.t_step)
+            world.advance(k_skip)
+        world.next_step()
+        if logger is not None:
+            logger.next_step(world.t_elapsed)
 
         v: Agent
-        for v in self._vessels.values():
-            v.next_step(self._world.t_step)
-            if hasattr(self, '_logger'):
-                self._logger.log_vessel(v)
-            v.update_other_vessels(self._vessels)
-
-    def _playback_next_step(self):
+        if fleet is not None:
+            fleet.next_step(world.t_step)
+            if logger is not None:
+                for v in self._vessels.values():
+                    logger.log_vessel(v)
+        else:
+            for v in self._vessels.values():
+                v.next_step(world.t_step)
+                if logger is not None:
+                    logger.log_vessel(v)
+                v.update_other_vessels(self._vessels)
+        if hasattr(self, '_detector'):
+            self._detect_events()
+
+    def _playback_next_step(self, n_steps: int = 1):
         v: Agent
-        self._playback.next_step()
+        self._playback.next_step(n_steps)
+        self._playback_n = self._playback.n
         t, self._vessels = self._playback.get_current_step()
+        self._instrument()
         self._plotter.set_time(t)
         for v in self._vessels.values():
             v.update_other_vessels(self._vessels)
@@ -175,26 +377,323 @@ class MASSsim():
             if self._is_plotter_running():
                 self._update_plotter()
 
-    def get_obs(self):
+    def run_steps(self, n_steps: int, stop=None):
+        """Run up to n_steps steps without drawing. Returns the number of
+        steps run"""
+        return self._run(n_steps=n_steps, stop=stop)
+
+    def run_until(self, t: float, stop=None):
+        """Run until the elapsed time reaches t. Returns the number of steps
+        run"""
+        return self._run(t_end=t, stop=stop)
+
+    def run_to_completion(self, stop=None):
+        """Run until every vessel has reached its final waypoint. Returns the
+        number of steps run"""
+        return self._run(stop=stop)
+
+    def _run(self, n_steps=None, t_end=None, stop=None):
+        # Headless fast-forward. The episode and stop checks are done once
+        # per step and the plotter is only updated at the end. stop is a
+        # function, or list of functions, of the simulator called after each
+        # step, and the run stops as soon as any of them returns True
+        if stop is None:
+            stop = []
+        elif callable(stop):
+            stop = [stop]
+        world = self._world
+        fleet = getattr(self, '_fleet', None)
+        vessels = list(self._vessels.values())
+        # Stop before overshooting t_end because of rounding in t_elapsed
+        t_end = t_end - world.t_step*1e-6 if t_end is not None else None
+
+        v: Agent
+        n = 0
+        while n_steps is None or n < n_steps:
+            if fleet is not None:
+                if fleet.all_final_waypoints_reached():
+                    break
+            elif all(v._final_waypoint_reached for v in vessels):
+                break
+            if t_end is not None and world.t_elapsed >= t_end:
+                break
+
+            self._manualtest_next_step()
+            n += 1
+
+            if any(s(self) for s in stop):
+                break
+
+        if hasattr(self, '_plotter'):
+            if self._is_plotter_running():
+                self._update_plotter()
+        return n
+
+    def run_events(self,
+                   t_end: float = None,
+                   wake_every_s: float = None,
+                   range_m: float = None,
+                   cpa_m: float = None,
+                   tcpa_max_s: float = np.inf,
+                   controller=None):
+        """Run with event-driven time advance, which needs the fleet engine.
+        Between events every vessel moves in a straight line, so the steps up
+        to the next waypoint arrival, controller wake-up every wake_every_s,
+        pair of vessels closing within range_m, pair which will pass within
+        cpa_m coming within tcpa_max_s of it, as in cpa_below, or t_end are
+        skipped in one update. controller(mass_sim) is called after every step
+        which isn't skipped, and only those steps are logged. The vessel
+        histories still hold every step. Returns the number of steps run"""
+        if not hasattr(self, '_fleet'):
+            raise ValueError("run_events needs the 'fleet' engine.")
+        logger = getattr(self, '_logger', None)
+        if logger is not None and logger.log_format == "commands":
+            raise ValueError("Command logs need every step, use run_until.")
+        fleet = self._fleet
+        world = self._world
+        t_step = world.t_step
+
+        n = 0
+        while not fleet.all_final_waypoints_reached():
+            # Steps which can be skipped before the next event. Arrivals are
+            # stepped into normally, with a step of margin for rounding
+            k = [fleet.steps_to_next_arrival(t_step) - 2]
+            if t_end is not None:
+                k_end = round((t_end - world.t_elapsed)/t_step)
+                if k_end <= 0:
+                    break
+                k.append(k_end - 1)
+            if wake_every_s is not None:
+                t_wake = (np.floor(world.t_elapsed/wake_every_s + 1e-9) + 1) \
+                    * wake_every_s
+                k.append(np.ceil((t_wake - world.t_elapsed)/t_step - 1e-9)
+                         - 1)
+            if range_m is not None:
+                k.append(fleet.steps_to_range(range_m, t_step) - 1)
+            if cpa_m is not None:
+                k.append(fleet.steps_to_cpa(cpa_m, tcpa_max_s, t_step) - 1)
+            if np.isinf(min(k)):
+                raise ValueError("No vessel can reach its waypoint and no " +
+                                 "other event is due, so the run would " +
+                                 "never end. Set t_end or wake_every_s.")
+            k_skip = int(max(min(k), 0))
+
+            self._manualtest_next_step(k_skip)
+            n += k_skip + 1
+            if controller is not None:
+                controller(self)
+
+        if hasattr(self, '_plotter'):
+            if self._is_plotter_running():
+                self._update_plotter()
+        return n
+
+    def get_obs(self, arrays: bool = False, copy: bool = True):
+        """Return the time and the vessels, or with arrays set, the state of
+        the vessels as arrays in the order of get_vessel_ids(). The arrays are
+        read-only and are a snapshot of the current step. With the fleet
+        engine and copy unset, the state arrays are views onto the simulator
+        state instead, which change on the next step, so nothing is copied"""
+        if arrays:
+            return self._get_obs_arrays(copy)
         obs_dict = {}
         obs_dict['time_s'] = self._world.t_elapsed
         obs_dict['vessels'] = self._vessels
         return obs_dict
 
+    def _get_obs_arrays(self, copy):
+        obs_dict = {}
+        obs_dict['time_s'] = self._world.t_elapsed
+        if hasattr(self, '_fleet'):
+            fleet = self._fleet
+            xy, xy_step = fleet.xy, fleet.xy_step
+            state = {'xy': xy,
+                     'course_deg': fleet.course_deg,
+                     'speed_mps': fleet.speed_mps,
+                     'waypoint_n': fleet.waypoint_n,
+                     'n_waypoints': fleet.n_waypoints,
+                     'target_xy': fleet.target_xy,
+                     'final_waypoint_reached': fleet.final_waypoint_reached}
+            if copy:
+                state = {key: value.copy() for key, value in state.items()}
+            # The encounter matrices are computed afresh after every step
+            # rather than updated, so are never copied
+            encounters = fleet.get_encounters()
+        else:
+            v: Agent
+            vessels = list(self._vessels.values())
+            xy = np.array([v.xy[0:2] for v in vessels])
+            xy_step = np.array([v.xy_step for v in vessels])
+            state = {'xy': xy,
+                     'course_deg': np.array([v.course_deg for v in vessels]),
+                     'speed_mps': np.array([v.speed_mps for v in vessels]),
+                     'waypoint_n': np.array([v.waypoint_n for v in vessels]),
+                     'n_waypoints': np.array([len(v.waypoints)
+                                              for v in vessels]),
+                     'target_xy': np.array(
+                         [v.waypoints[min(v.waypoint_n,
+                                          len(v.waypoints)-1)][0:2]
+                          for v in vessels]),
+                     'final_waypoint_reached': np.array(
+                         [v._final_waypoint_reached for v in vessels])}
+            encounters = compute_encounter_matrices(xy, xy_step)
+
+        for key, value in state.items():
+            obs_dict[key] = _read_only(value)
+        # Element [i, j] describes vessel j as seen from vessel i
+        for key, value in zip(['cpa_m', 'tcpa_s', 'range_m', 'bearing_deg'],
+                              encounters):
+            obs_dict[key] = _read_only(value)
+        return obs_dict
+
+    def get_vessel_ids(self):
+        return list(self._vessels.keys())
+
+    def set_actions(self,
+                    waypoints=None,
+                    speed_mps=None,
+                    course_deg=None):
+        """Apply actions to many vessels at once from arrays in the order of
+        get_vessel_ids(). waypoints has shape (N, 2) and each row sends that
+        vessel to the waypoint and then on to its goal, like set_waypoints.
+        speed_mps and course_deg have shape (N,). nan means no change"""
+        vessel_ids = self.get_vessel_ids()
+        if waypoints is not None:
+            waypoints = np.asarray(waypoints, dtype=float)
+            for i in np.flatnonzero(~np.isnan(waypoints).any(axis=1)):
+                self.set_waypoints(vessel_ids[i], [waypoints[i].tolist()])
+        if speed_mps is not None:
+            speed_mps = np.asarray(speed_mps, dtype=float)
+            for i in np.flatnonzero(~np.isnan(speed_mps)):
+                self.set_speed(vessel_ids[i], float(speed_mps[i]))
+        if course_deg is not None:
+            course_deg = np.asarray(course_deg, dtype=float)
+            for i in np.flatnonzero(~np.isnan(course_deg)):
+                self.set_course(vessel_ids[i], float(course_deg[i]))
+
     def set_waypoints(self, vessel_id, waypoints_utm):
+        if hasattr(self, '_logger'):
+            self._logger.log_command('waypoints',
+                                     vessel_id,
+                                     [list(wp) for wp in waypoints_utm])
         self._vessels[vessel_id].update_waypoints(waypoints_utm)
 
+    def set_speed(self, vessel_id, speed_mps):
+        if hasattr(self, '_logger'):
+            self._logger.log_command('speed', vessel_id, speed_mps)
+        self._vessels[vessel_id].update_speed(speed_mps)
+
+    def set_course(self, vessel_id, course_deg):
+        if hasattr(self, '_logger'):
+            self._logger.log_command('course', vessel_id, course_deg)
+        self._vessels[vessel_id].update_course(course_deg)
+
+    def get_pacing_stats(self):
+        """Return the frame rate, real-time factor and frame jitter of the
+        interactive viewer"""
+        return self._pacer.get_stats()
+
+    def get_events(self, close: bool = False):
+        """Return the encounter events since the last call, in time order,
+        which needs event_range_m set. close ends the encounters still open,
+        at the end of an episode. reset also ends them, and their events are
+        returned by the next call along with any not yet returned"""
+        if not hasattr(self, '_detector'):
+            raise ValueError("Event detection is off, set event_range_m.")
+        if close:
+            self._add_events(self._detector.finish())
+        events, self._events = self._events, []
+        return events
+
+    def _setup_events(self):
+        # With an event range set, encounters are found after every step
+        if self._event_range_m is None:
+            return
+        vessel_ids = list(self._vessels.keys())
+        if hasattr(self, '_detector'):
+            self._detector.reset(vessel_ids)
+        else:
+            self._detector = EncounterDetector(vessel_ids,
+                                               self._event_range_m,
+                                               self._event_thresholds_m)
+        self._events_to_log = []
+        # Start from the initial positions
+        self._detect_events()
+
+    def _detect_events(self):
+        if hasattr(self, '_fleet'):
+            xy = self._fleet.xy
+        else:
+            xy = [v.xy for v in self._vessels.values()]
+        self._add_events(self._detector.update(self._world.t_elapsed, xy))
+
+    def _add_events(self, events):
+        self._events += events
+        if not hasattr(self, '_logger'):
+            return
+        # Events are logged with the step they happened in, and those at the
+        # initial positions with the first step
+        self._events_to_log += events
+        if self._events_to_log and self._logger.n >= 0:
+            self._logger.add_events([asdict(e) for e in self._events_to_log])
+            self._events_to_log = []
+
+    def get_perf_stats(self):
+        """Return the number of calls, wall time and histogram of call
+        durations of each phase of the simulation since the episode started,
+        which needs profile set. The steps are the steps computed, so with
+        run_events the steps skipped over aren't counted"""
+        if self._profiler is None:
+            raise ValueError("Profiling is off, set profile=True.")
+        return self._profiler.get_stats(self._profiler.calls('world'))
+
+    def _instrument(self):
+        # Wrap the methods making up each phase with timers. This is only
+        # done with profiling on, so otherwise the steps are untouched.
+        # Repeated calls only wrap objects which have been replaced
+        prof = self._profiler
+        if prof is None:
+            return
+        prof.instrument(self._world, 'world', 'next_step')
+        v: Agent
+        for v in self._vessels.values():
+            prof.instrument(v, 'vessels', 'next_step')
+            prof.instrument(v, 'encounters', 'update_other_vessels')
+        if hasattr(self, '_fleet'):
+            prof.instrument(self._fleet, 'vessels', 'next_step')
+            prof.instrument(self._fleet, 'vessels', 'advance')
+            prof.instrument(self._fleet, 'events', 'steps_to_next_arrival')
+            prof.instrument(self._fleet, 'events', 'steps_to_range')
+            prof.instrument(self._fleet, 'encounters', 'get_encounters')
+        if hasattr(self, '_detector'):
+            prof.instrument(self._detector, 'encounter_events', 'update')
+        if hasattr(self, '_logger'):
+            for method in ['next_step', 'log_vessel', 'log_command']:
+                prof.instrument(self._logger, 'logging', method)
+            prof.instrument(self._logger, 'saving', 'save_log_file')
+        if hasattr(self, '_playback'):
+            prof.instrument(self._playback, 'playback', 'get_current_step')
+        if hasattr(self, '_plotter'):
+            prof.instrument(self, 'plotter', '_update_plotter')
+            prof.instrument(self._plotter, 'render', 'is_plotter_running')
+
     def _update_plotter(self):
         v: Agent
-        self._plotter.update_time(self._world.t_elapsed)
+        rtf = None
+        if hasattr(self, '_pacer') and self._plotter.play:
+            rtf = self._pacer.get_stats()['rtf']
+        self._plotter.update_time(self._world.t_elapsed, rtf)
         self._plotter.update_vessels(vessels=self._vessels)
         wp = self._plotter.get_waypoint_updates()
         if wp:
             for v in wp:
                 self.set_waypoints(v, wp[v])
 
-    def _get_scenario(self, scenario):
-        if scenario == "":
+    @staticmethod
+    def _get_scenario(scenario):
+        if isinstance(scenario, dict):
+            return scenario
+        elif scenario == "":
             raise ValueError("scenario_n argument not set." +
                              "Must either be the number of the " +
                              "desired scenario or a str containing" +
@@ -211,50 +710,13 @@ class MASSsim():
             conf = json.load(f)
         return conf
 
-    def _setup_scene(self, conf):
-        # Set up utm conversion
-        p = pyproj.Proj(proj='utm',
-                        zone=30,
-                        ellps='WGS84',
-                        preserve_units=False)
-
-        params = conf['params']
-
-        # initialise the other vessels
-        vessels = {}
-        xy_lim_tmp = []
-        for v in conf['vessel_details']:
-            # Get the vessel details
-            way_points = []
-            for wp in v["waypoints"]:
-                wp_temp = list(p(convert_dms_to_dec(wp[1]),
-                                 convert_dms_to_dec(wp[0])))
-                # If there's a speed change, add an extra element
-                if len(wp) == 3:
-                    wp_temp.append(wp[2])
-                way_points.append(wp_temp)
-                # get waypoints for the computation of the limits
-                xy_lim_tmp.append(wp_temp[0:2])
-
-            if "speed_mps" in v:
-                speed_mps = v['speed_mps']
-            else:
-                speed_mps = 0.5144*v["speed_kn"]
-            course = compute_bearing(way_points[0],
-                                     way_points[1])
-
-            vessels[v['vessel']] = Agent(vessel_id=v['vessel'],
-                                         xy_init=way_points[0],
-                                         speed_mps=speed_mps,
-                                         waypoints=way_points)
-
-        xy_lim_tmp_np = np.array(xy_lim_tmp)
-        # Get limits of travel for vessel travel
-        xy_lim = [xy_lim_tmp_np[:, 0].min(),
-                  xy_lim_tmp_np[:, 0].max(),
-                  xy_lim_tmp_np[:, 1].min(),
-                  xy_lim_tmp_np[:, 1].max()]
-        return conf, params, vessels, xy_lim
+    @staticmethod
+    def _setup_scene(conf):
+        # The projected waypoints come from the scenario cache, so setting up
+        # the same scenario again only builds the vessels
+        scenario = compile_scenario(conf)
+        vessels = scenario.make_vessels()
+        return conf, conf['params'], vessels, list(scenario.xy_lim)
 
     def _get_log_path(self, log_file):
         if log_file == "":
@@ -264,14 +726,65 @@ class MASSsim():
                              " the path to the custom scenario json file.")
         elif isinstance(log_file, int):
             conf_loc = os.path.join(os.path.dirname(__file__), '..')
-            log_path = os.path.join(conf_loc, 'logs',
-                                    f"log_{log_file}.json")
+            # Use whichever format the numbered log was saved in
+            for ext in LOG_EXTENSIONS.values():
+                log_path = os.path.join(conf_loc, 'logs',
+                                        f"log_{log_file}{ext}")
+                if os.path.exists(log_path):
+                    break
         elif isinstance(log_file, str):
             log_path = log_file
 
         return log_path
 
 
+def _read_only(a):
+    # A view which can't be used to change the simulator state
+    a = a.view()
+    a.flags.writeable = False
+    return a
+
+
+def _get_plotter_class():
+    # dearpygui is only imported when a plotter is wanted, so headless runs
+    # start quickly and work without it installed
+    try:
+        from mass_simulator.plotter import Plotter
+    except ImportError as e:
+        raise ImportError("The plotter needs dearpygui. Install it with " +
+                          "'pip install dearpygui', or use mode='test' " +
+                          "with plotter=False.") from e
+    return Plotter
+
+
+def cpa_below(cpa_m: float, tcpa_max_s: float = np.inf):
+    """Stop predicate for the run methods which is True once any pair of
+    vessels will pass within cpa_m metres in the next tcpa_max_s seconds"""
+    def stop(mass_sim: MASSsim):
+        # The fleet engine checks every pair at once from its encounters
+        if hasattr(mass_sim, '_fleet'):
+            fleet = mass_sim._fleet
+            if fleet.encounter_range_m is None:
+                cpa, tcpa = fleet.get_encounters()[0:2]
+            else:
+                cpa, tcpa = fleet.get_encounter_pairs()[2:4]
+            return bool(np.any((cpa < cpa_m) & (tcpa <= tcpa_max_s)))
+        for v in mass_sim._vessels.values():
+            for o in v.other_vessels.values():
+                if o.cpa_m < cpa_m and o.tcpa_s <= tcpa_max_s:
+                    return True
+        return False
+    return stop
+
+
+def time_reached(t: float):
+    """Stop predicate for the run methods which is True once the elapsed
+    time reaches t"""
+    def stop(mass_sim: MASSsim):
+        return mass_sim._world.t_elapsed >= t
+    return stop
+
+
 def main():
     mass_sim = MASSsim(scenario=3,
                        mode='manual',
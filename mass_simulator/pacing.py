@@ -0,0 +1,101 @@
+from collections import deque
+from time import perf_counter, sleep
+import numpy as np
+
+
+class Pacer():
+    """ Keeps the simulation clock of the interactive loops separate from the
+    rendering. Each frame, steps_due gives the number of simulation steps
+    needed to keep up with playspeed times real time, and the steps are run
+    until the frame's step budget, frame_budget of the 1/target_fps frame
+    period, is used up. Steps which can't be run within the budget are
+    dropped rather than carried over, so a slow scenario runs as fast as it
+    can without the frame rate collapsing.
+
+    Between frames, wait sleeps until the next frame deadline instead of
+    polling the clock. Deadlines are scheduled from the previous deadline
+    rather than from when the frame finished, so the frame rate doesn't
+    drift, and while paused frames are only drawn at idle_fps. The measured
+    frame rate, real-time factor and frame jitter over the last stats_window
+    frames are returned by get_stats.
+    """
+
+    def __init__(self,
+                 t_step: float,
+                 target_fps: float = 60.,
+                 frame_budget: float = 0.8,
+                 idle_fps: float = 20.,
+                 stats_window: int = 120):
+        self.t_step = t_step
+        self.target_fps = target_fps
+        self.frame_budget = frame_budget
+        self.idle_fps = idle_fps
+        self._sim_debt = 0.
+        self._t_last = None
+        self._frame_start = perf_counter()
+        self._deadline = self._frame_start
+        self._paused = False
+
+        # Frame start times and the simulation time run in each frame
+        self._frame_starts = deque(maxlen=stats_window)
+        self._frame_sim_s = deque(maxlen=stats_window)
+
+    def start_frame(self):
+        self._frame_start = perf_counter()
+        self._frame_starts.append(self._frame_start)
+        self._frame_sim_s.append(0.)
+
+    def steps_due(self,
+                  playspeed: float):
+        """Return the number of simulation steps to run this frame"""
+        self._paused = False
+        t = perf_counter()
+        if self._t_last is not None:
+            self._sim_debt += (t - self._t_last)*playspeed
+        self._t_last = t
+        n = int(self._sim_debt // self.t_step)
+        self._sim_debt -= n*self.t_step
+        return n
+
+    def add_steps(self,
+                  n_steps: int):
+        """Record the simulation steps run this frame"""
+        if self._frame_sim_s:
+            self._frame_sim_s[-1] += n_steps*self.t_step
+
+    def within_budget(self):
+        """Whether there is time left for more steps this frame"""
+        return perf_counter() - self._frame_start < \
+            self.frame_budget/self.target_fps
+
+    def pause(self):
+        # Time spent paused isn't owed to the simulation
+        self._sim_debt = 0.
+        self._t_last = None
+        self._paused = True
+
+    def wait(self):
+        """Sleep until the next frame is due"""
+        fps = self.idle_fps if self._paused else self.target_fps
+        self._deadline += 1/fps
+        t = perf_counter()
+        if self._deadline < t - 1/fps:
+            # More than a frame behind, so start the schedule again from now
+            # rather than rushing to catch up
+            self._deadline = t
+        elif self._deadline > t:
+            sleep(self._deadline - t)
+
+    def get_stats(self):
+        """Return the measured frames per second, real-time factor of the
+        simulation and the standard deviation of the frame period in ms"""
+        if len(self._frame_starts) < 2:
+            return {'fps': np.nan, 'rtf': np.nan, 'jitter_ms': np.nan}
+        starts = np.array(self._frame_starts)
+        periods = np.diff(starts)
+        wall_s = starts[-1] - starts[0]
+        # The last frame is still in progress
+        sim_s = sum(list(self._frame_sim_s)[:-1])
+        return {'fps': len(periods)/wall_s,
+                'rtf': sim_s/wall_s,
+                'jitter_ms': 1000*periods.std()}
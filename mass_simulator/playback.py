@@ -1,76 +1,113 @@
-import json
 import numpy as np
 from mass_simulator.agent import Agent
+from mass_simulator.logger import LOG_EXTENSIONS
+from mass_simulator.columnar import LogReader, open_columnar_log, load_json_log
+from mass_simulator.lazy_log import LazyLogReader
+from mass_simulator.command_log import CommandLogReader
+from mass_simulator.general import *
 
 
 class Playback():
     """ Playback class for the MASS simulator
+
+    Every log format is read into the same columnar form, with a (time,
+    vessel, field) state array and a time index, so seeking to any step is an
+    array lookup and the vessel histories are slices of the state array.
+    Columnar logs are memory mapped rather than loaded, ndjson logs are read
+    lazily in chunks around the playback position unless lazy is False, and
+    command logs are re-simulated from their keyframes.
     """
 
     def __init__(self,
-                 log_file):
-        # load the log file
-        with open(log_file, 'r') as f:
-            log_dict = json.load(f)
-
-        self.setup = log_dict['setup']
-        self.log_dict = log_dict['log']
-        self.t_max = self.log_dict[-1]['time']
-        self.N = len(self.log_dict)
+                 log_file,
+                 lazy: bool = True):
+        self._reader = open_log_reader(log_file, lazy=lazy)
+        self.setup = self._reader.setup
+        self._time = self._reader.time
+        self._state = self._reader.state
+        self.t_max = self._time[-1]
+        self.N = len(self._time)
         self.n = 0
 
+        # Vessels are created once and then updated in place
+        self._vessels = {}
+        self._current_vessels = {}
+        self._current_n = None
+
     def get_setup(self):
         return self.setup
 
     def get_time_req(self,
                      n):
         # get the n step
-        t = self.log_dict[n+1]['time'] - self.log_dict[n]['time']
-        speed_req = None
-        course_req = None
-        if 'speed_req' in self.log_dict[n]:
-            speed_req = self.log_dict[n]['speed_req']
-        if 'course_req' in self.log_dict[n]:
-            course_req = self.log_dict[n]['course_req']
-
-        return t, speed_req, course_req
+        t = self._time[n+1] - self._time[n]
+        extras = self._reader.get_extras(n)
+        return t, extras.get('speed_req'), extras.get('course_req')
 
     def get_xy_lims(self):
-        # get the xy limits
-        xy_lims = [np.inf, -np.inf, np.inf, -np.inf]
-        for n in self.log_dict:
-            for v in n['vessels']:
-                xy_lims[0] = min(xy_lims[0], v['xy'][0])
-                xy_lims[1] = max(xy_lims[1], v['xy'][0])
-                xy_lims[2] = min(xy_lims[2], v['xy'][1])
-                xy_lims[3] = max(xy_lims[3], v['xy'][1])
+        # get the xy limits of the steps which have been loaded
+        xy = self._state[:, :, 0:2]
+        return [np.nanmin(xy[..., 0]), np.nanmax(xy[..., 0]),
+                np.nanmin(xy[..., 1]), np.nanmax(xy[..., 1])]
 
-        return xy_lims
-
-    def next_step(self):
-        self.n += 1
+    def next_step(self, n_steps: int = 1):
+        self.n = min(self.n + n_steps, self.N-1)
 
     def set_t(self, t):
-        t_vals = [t['time'] for t in self.log_dict]
-        n = t_vals.index(t)
-        self.n = np.clip(n, 1, self.N-1)
+        n = np.searchsorted(self._time, t)
+        self.n = int(np.clip(n, 1, self.N-1))
 
     def get_current_step(self):
         n = self.n
-        t = self.log_dict[n]['time']
+        t = self._time[n]
+        if n == self._current_n:
+            return t, self._current_vessels
+
+        # Load this step and start loading ahead in the direction of play
+        direction = 1 if self._current_n is None or n > self._current_n \
+            else -1
+        self._reader.load(n)
+        self._reader.prefetch(n, direction)
 
-        # get the initial vessels details
         vessels = {}
-        for v in self.log_dict[n]['vessels']:
-            v_temp = Agent(vessel_id=v['vessel_id'],
-                           xy_init=v['xy'],
-                           speed_kn=v['speed_kn'],
-                           speed_mps=v['speed_mps'],
-                           waypoints=v['waypoints'])
-            v_temp.course_deg = v['course_deg']
-            for d_n in self.log_dict[0:n]:
-                v_temp.xy_hist.append([v_n['xy']for v_n in d_n['vessels']
-                                       if v_n['vessel_id'] == v['vessel_id']][0])
-            v_temp.xy_hist = v_temp.xy_hist[1:]
-            vessels[v['vessel_id']] = v_temp
+        for i, vessel_id in enumerate(self._reader.vessel_ids):
+            x, y, course_deg, speed_mps = self._state[n, i]
+            if np.isnan(x):
+                continue
+            waypoints = self._reader.get_waypoints(vessel_id, n)
+
+            if vessel_id not in self._vessels:
+                self._vessels[vessel_id] = Agent(vessel_id=vessel_id,
+                                                 xy_init=[x, y],
+                                                 speed_mps=speed_mps,
+                                                 waypoints=waypoints)
+            v = self._vessels[vessel_id]
+            v.xy = [x, y]
+            v.course_deg = course_deg
+            v.speed_mps = speed_mps
+            v.speed_kn = mps_to_kn(speed_mps)
+            v.waypoints = waypoints
+            v._compute_xy_step()
+            # The history is a view onto the state array
+            v.xy_hist = self._state[0:n+1, i, 0:2]
+            vessels[vessel_id] = v
+
+        self._current_vessels = vessels
+        self._current_n = n
         return t, vessels
+
+    def close(self):
+        self._reader.close()
+
+
+def open_log_reader(log_file,
+                    lazy: bool = True):
+    """Open a log of any format in columnar form. ndjson logs are only read
+    lazily if lazy is set"""
+    if log_file.endswith(LOG_EXTENSIONS['npz']):
+        return LogReader(open_columnar_log(log_file))
+    elif log_file.endswith(LOG_EXTENSIONS['ndjson']) and lazy:
+        return LazyLogReader(log_file)
+    elif log_file.endswith(LOG_EXTENSIONS['commands']):
+        return CommandLogReader(log_file)
+    return LogReader(load_json_log(log_file).get_log())
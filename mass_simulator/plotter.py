@@ -1,15 +1,31 @@
 import dearpygui.dearpygui as dpg
 from mass_simulator.agent import Agent, OtherVessel
 import os
+import colorsys
 import numpy as np
 from mass_simulator.general import *
 
 
 class Plotter():
+    """ Plotter class for the MASS simulator
+
+    The trail of each vessel is split into an older part, simplified to the
+    screen resolution and only redrawn when trail_chunk new points have built
+    up, and a live part holding the latest points. Only the live part is sent
+    each frame, so the frame time doesn't grow with the episode length. The
+    older part is simplified again from the history when the zoom changes by
+    more than a factor of two.
+
+    The AIS Data table shows the max_table_vessels vessels nearest to the
+    vessel in focus, so scenarios with many vessels still fit on screen.
+    """
+
     def __init__(self,
                  vessels,
                  xy_lims,
-                 control=True):
+                 control=True,
+                 trail_chunk: int = 256,
+                 max_table_vessels: int = 8):
 
         self.play = True
         self.playspeed = 10
@@ -18,7 +34,12 @@ class Plotter():
         self._waypoints_temp = {}
         self._send_waypoints = False
         self._vessel_id_foc = vessels["agent"].vessel_id
+        self.trail_chunk = trail_chunk
+        self._trails = {}
+        self._lod_tol = 1.
+        self._waypoints_drawn = {}
         vessel_N = len(vessels)
+        self._table_N = min(vessel_N-1, max_table_vessels)
 
         dpg.create_context()
         dpg.configure_app(init_file=os.path.join(os.path.dirname(__file__),
@@ -40,7 +61,7 @@ class Plotter():
                                        handler_registry="click_handler")
 
         self._add_vessels(vessels=vessels)
-        self._initialise_variable_viewer(vessel_N)
+        self._initialise_variable_viewer(self._table_N+1)
         if control:
             self._initialise_controls()
 
@@ -57,7 +78,13 @@ class Plotter():
                 [0.9960, 0.5640, 0.2620],
                 [0.4540, 0.9210, 0.8540],
                 [0, 0.6390, 0.6390]]
-        return [c*255 for c in cols[n]]
+        if n < len(cols):
+            return [c*255 for c in cols[n]]
+        # Further vessels step round the hues by the golden ratio, so
+        # neighbouring vessels get well separated colours however many there
+        # are
+        hue = (0.6180340*(n - len(cols))) % 1
+        return [c*255 for c in colorsys.hsv_to_rgb(hue, 0.7, 0.95)]
 
     def _setup_plot_themes(self, n):
         col = self._get_plot_colors(n)
@@ -226,7 +253,12 @@ class Plotter():
             # Setup plot colours for the boat
             col = self._setup_plot_themes(n)
 
-            # Set up line for history
+            # Set up lines for the simplified older history and the latest
+            # history
+            dpg.add_line_series(x=[],
+                                y=[],
+                                parent='map_y_axis',
+                                tag=f"tag_trail_{v_key}")
             dpg.add_line_series(label=v_key,
                                 x=[v.xy[0]],
                                 y=[v.xy[1]],
@@ -272,6 +304,8 @@ class Plotter():
                                    parent="map_y_axis")
 
             # Change the colours of the plots
+            dpg.bind_item_theme(f"tag_trail_{v_key}",
+                                f'line_theme_{n}')
             dpg.bind_item_theme(f"tag_hist_{v_key}",
                                 f'line_theme_{n}')
             dpg.bind_item_theme(f"waypoint_plot_{v_key}",
@@ -320,6 +354,7 @@ class Plotter():
     def update_vessels(self,
                        vessels: dict):
         v: Agent
+        self._lod_tol = self._get_lod_tolerance()
         for v in vessels.values():
             self._update_vessel_plot(v.vessel_id,
                                      v.xy,
@@ -333,8 +368,16 @@ class Plotter():
     def _update_vessels_table(self,
                               vessels: dict):
         v: OtherVessel
+        keys = list(vessels.keys())
+        if len(keys) > self._table_N:
+            # Only the nearest vessels fit. Every vessel has its range, even
+            # out of encounter range, so they're all sorted by distance
+            ranges = np.array([vessels[k].range_m for k in keys], dtype=float)
+            nearest = np.argsort(ranges, kind='stable')[:self._table_N]
+            keys = [keys[i] for i in nearest]
         n = 0
-        for key, v in vessels.items():
+        for key in keys:
+            v = vessels[key]
             col = dpg.get_item_configuration(f"tag_triangle_{key}")['color']
             dpg.configure_item(f"tag_id_v{n}",
                                label=key)
@@ -361,8 +404,7 @@ class Plotter():
                                 [xy[0], xy[1]])*dpg.create_rotation_matrix(course_rad,
                                                                            [0, 0, -1]))
         # Update history
-        dpg.set_value(f"tag_hist_{vessel_id}",
-                      list(zip(*xy_hist)))
+        self._update_trail(vessel_id, xy_hist)
 
         dpg.configure_item(f"annot_{vessel_id}",
                            default_value=[xy[0],
@@ -370,16 +412,20 @@ class Plotter():
                            label=f"{vessel_id}\n"
                            f"speed {speed_kn:.1f}kn \n"
                            f"course {course_deg:.1f}deg")
-        # Update waypoints if they've changed
-        wps = [list(wp) for wp in list(zip(*waypoints))]
-        if dpg.get_value(f"waypoint_plot_{vessel_id}") != wps:
+        # Update waypoints if they've changed, either replaced by another
+        # list or edited in place
+        drawn = self._waypoints_drawn.get(vessel_id)
+        wp_values = [list(wp) for wp in waypoints]
+        if drawn is None or drawn[0] is not waypoints or \
+                drawn[1] != wp_values:
+            self._waypoints_drawn[vessel_id] = (waypoints, wp_values)
             dpg.set_value(f"waypoint_plot_{vessel_id}",
                           list(zip(*waypoints)))
 
             wp_x = [x[0] for x in waypoints]
             wp_y = [x[1] for x in waypoints]
-            wp_x.insert(0, xy_hist[-1][0])
-            wp_y.insert(0, xy_hist[-1][1])
+            wp_x.insert(0, xy[0])
+            wp_y.insert(0, xy[1])
             wp_x_int = list(np.interp(np.linspace(0, len(wp_x), 40),
                                       np.linspace(0, len(wp_x), len(wp_x)),
                                       wp_x))
@@ -391,9 +437,70 @@ class Plotter():
                           [wp_x_int,
                            wp_y_int])
 
-    def update_time(self, t):
+    def _update_trail(self,
+                      vessel_id,
+                      xy_hist):
+        # Histories are followed by the number of points appended, which is
+        # the length for plain arrays
+        count = getattr(xy_hist, 'count', None)
+        if count is None:
+            xy_hist = np.asarray(xy_hist)
+            count = len(xy_hist)
+        trail = self._trails.get(vessel_id)
+
+        # Start again if the history has gone back, e.g. seeking in playback,
+        # or the zoom has changed so much that the simplified part is too
+        # coarse or more detailed than needed
+        tol = self._lod_tol
+        if trail is None or count < trail['count'] or \
+                not 0.5 < tol/trail['tol'] < 2:
+            trail = {'count': 0,
+                     'tol': tol,
+                     'frozen': np.zeros((0, 2)),
+                     'live': np.zeros((0, 2))}
+            self._trails[vessel_id] = trail
+            dpg.set_value(f"tag_trail_{vessel_id}", [[], []])
+        if count == trail['count']:
+            return
+        if hasattr(xy_hist, 'since'):
+            new = xy_hist.since(trail['count'])
+        else:
+            new = xy_hist[trail['count']:]
+        trail['count'] = count
+        # Steps of a log which haven't been decoded are nan
+        new = new[:, 0:2]
+        new = new[~np.isnan(new[:, 0])]
+        live = np.concatenate([trail['live'], new])
+
+        # Move all but the last point of a full live part to the simplified
+        # part, which then joins up with the new live part
+        if len(live) > self.trail_chunk:
+            frozen = simplify_polyline(live, trail['tol'])
+            if len(trail['frozen']):
+                frozen = frozen[1:]
+            trail['frozen'] = np.concatenate([trail['frozen'], frozen])
+            live = live[-1:]
+            dpg.set_value(f"tag_trail_{vessel_id}",
+                          [trail['frozen'][:, 0].tolist(),
+                           trail['frozen'][:, 1].tolist()])
+        trail['live'] = live
+        dpg.set_value(f"tag_hist_{vessel_id}",
+                      [live[:, 0].tolist(), live[:, 1].tolist()])
+
+    def _get_lod_tolerance(self):
+        # Half a pixel at the current zoom, in metres
+        x_min, x_max = dpg.get_axis_limits("map_x_axis")
+        width = dpg.get_item_rect_size("map_plot_tag")[0]
+        if width <= 0 or x_max <= x_min:
+            return 1.
+        return 0.5*(x_max - x_min)/width
+
+    def update_time(self, t, rtf=None):
+        text = f"Time: {np.floor(t/60):.0f}min {t%60:.0f}s"
+        if rtf is not None and not np.isnan(rtf):
+            text += f" ({rtf:.1f}x)"
         dpg.configure_item("time_tag",
-                           default_value=f"Time: {np.floor(t/60):.0f}min {t%60:.0f}s")
+                           default_value=text)
 
     def is_plotter_running(self):
         if dpg.is_dearpygui_running():
@@ -0,0 +1,107 @@
+from time import perf_counter
+
+
+class Profiler():
+    """ Opt-in timing of the phases of the simulation, such as moving the
+    vessels, computing the encounters, logging and drawing.
+
+    instrument replaces a method on an object with a timed wrapper counting
+    towards a phase, so the simulation loops themselves are unchanged and
+    nothing is timed, or costs anything, unless a profiler is set up. For each
+    phase the number of calls and the total and maximum wall time are kept,
+    along with a histogram of the call durations in power of two buckets of
+    microseconds. Bucket 0 counts calls under 1 us and bucket k calls from
+    2**(k-1) to 2**k us, with the last bucket taking everything longer.
+    """
+
+    def __init__(self,
+                 n_buckets: int = 24):
+        self.n_buckets = n_buckets
+        self._phases = {}
+
+    def reset(self):
+        """Clear the stats, keeping the wrappers already in place"""
+        for stats in self._phases.values():
+            stats.clear()
+
+    def wrap(self,
+             phase: str,
+             func):
+        """Return func timed as part of phase"""
+        if phase not in self._phases:
+            self._phases[phase] = PhaseStats(self.n_buckets)
+        stats = self._phases[phase]
+
+        def timed(*args, **kwargs):
+            t = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add(perf_counter() - t)
+        timed._profiled = func
+        return timed
+
+    def instrument(self,
+                   obj,
+                   phase: str,
+                   method: str):
+        """Time calls of obj.method as part of phase. Methods which are
+        already timed are left alone, so this can be repeated safely"""
+        func = getattr(obj, method)
+        if not hasattr(func, '_profiled'):
+            setattr(obj, method, self.wrap(phase, func))
+
+    def calls(self,
+              phase: str):
+        if phase not in self._phases:
+            return 0
+        return self._phases[phase].calls
+
+    def get_stats(self,
+                  n_steps: int):
+        """Return the stats of every phase called so far, with the time and
+        calls per step over n_steps steps"""
+        phases = {}
+        for phase, stats in self._phases.items():
+            if not stats.calls:
+                continue
+            phases[phase] = {
+                'calls': stats.calls,
+                'calls_per_step': stats.calls/n_steps if n_steps else None,
+                'total_s': stats.total_s,
+                'mean_us': 1e6*stats.total_s/stats.calls,
+                'max_us': 1e6*stats.max_s,
+                'per_step_us': 1e6*stats.total_s/n_steps if n_steps
+                else None,
+                'hist': list(stats.hist)}
+        return {'steps': n_steps,
+                'hist_edges_us': [0] + [2**k for k in range(self.n_buckets-1)],
+                'phases': phases}
+
+
+class PhaseStats():
+    """ Call count, times and duration histogram of one phase.
+    """
+    __slots__ = ['calls', 'total_s', 'max_s', 'hist', '_last']
+
+    def __init__(self,
+                 n_buckets: int):
+        self.hist = [0]*n_buckets
+        self._last = n_buckets - 1
+        self.clear()
+
+    def clear(self):
+        self.calls = 0
+        self.total_s = 0.
+        self.max_s = 0.
+        for k in range(len(self.hist)):
+            self.hist[k] = 0
+
+    def add(self, dt):
+        self.calls += 1
+        self.total_s += dt
+        if dt > self.max_s:
+            self.max_s = dt
+        # The bit length of the whole microseconds is the power of two bucket
+        k = int(dt*1e6).bit_length()
+        self.hist[k if k < self._last else self._last] += 1
@@ -0,0 +1,279 @@
+import os
+import json
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from mass_simulator.agent import Agent
+from mass_simulator.general import *
+
+# Bumped whenever the compiled form changes, so old cache files are ignored
+CACHE_VERSION = 1
+
+# Compiled scenarios and projected waypoints of this process, keyed by hash.
+# Only the CACHE_SIZE most recently used of each are kept, as every jittered
+# or generated scenario hashes differently
+CACHE_SIZE = 64
+_compiled_cache = OrderedDict()
+_projection_cache = OrderedDict()
+
+
+@dataclass
+class CompiledScenario:
+    """ A scenario with its waypoints projected to UTM, ready to build the
+    vessels from. waypoints[i] is a (n, 3) array of x, y and the optional
+    speed change at each waypoint of vessel i, which is nan when not set.
+    utm_zone is None if the waypoints were all given in UTM.
+    """
+    conf: dict
+    key: str
+    vessel_ids: list
+    speed_mps: np.ndarray
+    waypoints: list
+    xy_lim: list
+    utm_zone: int
+    south: bool
+
+    @property
+    def params(self):
+        return self.conf['params']
+
+    def _get_vessel_details(self):
+        for vessel_id, speed_mps, waypoints in zip(self.vessel_ids,
+                                                   self.speed_mps,
+                                                   self.waypoints):
+            way_points = [wp[0:2] if np.isnan(wp[2]) else wp
+                          for wp in waypoints.tolist()]
+            yield vessel_id, float(speed_mps), way_points
+
+    def make_vessels(self, **agent_kwargs):
+        """Return new Agents for the vessels of the scenario"""
+        vessels = {}
+        for vessel_id, speed_mps, way_points in self._get_vessel_details():
+            vessels[vessel_id] = Agent(vessel_id=vessel_id,
+                                       xy_init=way_points[0],
+                                       speed_mps=speed_mps,
+                                       waypoints=way_points,
+                                       **agent_kwargs)
+        return vessels
+
+    def reset_vessels(self, vessels: dict):
+        """Restore existing Agents, with the same vessel ids as the
+        scenario, to the initial conditions of the scenario"""
+        v: Agent
+        for vessel_id, speed_mps, way_points in self._get_vessel_details():
+            v = vessels[vessel_id]
+            v.reset(xy_init=way_points[0],
+                    waypoints=way_points,
+                    speed_mps=speed_mps)
+
+
+def get_cache_dir():
+    """Directory of the on-disk scenario cache, set with the
+    MASS_SIMULATOR_CACHE environment variable. It's off unless set"""
+    return os.environ.get('MASS_SIMULATOR_CACHE', '')
+
+
+def hash_scenario(conf: dict):
+    return hashlib.sha256(json.dumps(conf, sort_keys=True).encode()
+                          ).hexdigest()
+
+
+def validate_scenario(conf: dict):
+    """Check a scenario has everything needed to set it up, raising a
+    ValueError describing the first problem found"""
+    if 't_step' not in conf.get('params', {}):
+        raise ValueError("Scenario params must contain t_step.")
+    if not conf.get('vessel_details'):
+        raise ValueError("Scenario must contain vessel_details.")
+    vessel_ids = set()
+    for v in conf['vessel_details']:
+        if 'vessel' not in v:
+            raise ValueError("Every vessel must have a 'vessel' id.")
+        if v['vessel'] in vessel_ids:
+            raise ValueError(f"Vessel id {v['vessel']} is used twice.")
+        vessel_ids.add(v['vessel'])
+        if 'speed_mps' not in v and 'speed_kn' not in v:
+            raise ValueError(f"No speed specified for vessel {v['vessel']}")
+        if len(v.get('waypoints', [])) < 2:
+            raise ValueError(f"Vessel {v['vessel']} needs at least two " +
+                             "waypoints.")
+        for wp in v['waypoints']:
+            if len(wp) not in [2, 3]:
+                raise ValueError(f"Waypoint {wp} of vessel {v['vessel']} " +
+                                 "must be [lat, lon] or [lat, lon, speed].")
+            if isinstance(wp[0], str) != isinstance(wp[1], str):
+                raise ValueError(f"Waypoint {wp} of vessel {v['vessel']} " +
+                                 "mixes DMS and UTM coordinates.")
+
+
+def get_utm_zone(lon, lat):
+    """Return the UTM zone containing the mean of the given coordinates, and
+    whether it's in the southern hemisphere"""
+    zone = int(np.floor((np.mean(lon) + 180)/6) % 60) + 1
+    return zone, bool(np.mean(lat) < 0)
+
+
+def compile_scenario(conf: dict,
+                     cache_dir: str = None):
+    """Compile a scenario dictionary, reusing the compiled form from the
+    process or disk cache when the same scenario has been compiled before"""
+    key = hash_scenario(conf)
+    if key in _compiled_cache:
+        _compiled_cache.move_to_end(key)
+        return _compiled_cache[key]
+
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    compiled = _load_compiled(cache_dir, key) if cache_dir else None
+    if compiled is None:
+        # Compile a copy so later changes to conf can't affect the cache
+        compiled = _compile(json.loads(json.dumps(conf)), key)
+        if cache_dir:
+            _save_compiled(cache_dir, compiled)
+    _add_to_cache(_compiled_cache, key, compiled)
+    return compiled
+
+
+def _add_to_cache(cache, key, value):
+    # Add to a process cache, dropping the least recently used entry if full
+    cache[key] = value
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _compile(conf, key):
+    validate_scenario(conf)
+    waypoints, utm_zone, south = _project_waypoints(conf)
+
+    speed_mps = []
+    for v in conf['vessel_details']:
+        if "speed_mps" in v:
+            speed_mps.append(v['speed_mps'])
+        else:
+            speed_mps.append(0.5144*v["speed_kn"])
+
+    # Limits of travel for the plot
+    xy = np.concatenate(waypoints)
+    xy_lim = [xy[:, 0].min(),
+              xy[:, 0].max(),
+              xy[:, 1].min(),
+              xy[:, 1].max()]
+    return CompiledScenario(conf=conf,
+                            key=key,
+                            vessel_ids=[v['vessel']
+                                        for v in conf['vessel_details']],
+                            speed_mps=np.array(speed_mps, dtype=float),
+                            waypoints=waypoints,
+                            xy_lim=[float(x) for x in xy_lim],
+                            utm_zone=utm_zone,
+                            south=south)
+
+
+def _project_waypoints(conf):
+    # The projection only depends on the waypoints, so scenarios which only
+    # differ in speeds or params share it
+    geometry = {'waypoints': [v['waypoints']
+                              for v in conf['vessel_details']],
+                'utm_zone': conf['params'].get('utm_zone')}
+    key = hash_scenario(geometry)
+    if key in _projection_cache:
+        _projection_cache.move_to_end(key)
+        return _projection_cache[key]
+
+    # Waypoints are either [lat, lon] in degrees, minutes and seconds, or
+    # [x, y] already in UTM metres
+    latlon = []
+    xy = []
+    speed = []
+    n_waypoints = []
+    for v in conf['vessel_details']:
+        for wp in v['waypoints']:
+            if isinstance(wp[0], str):
+                latlon.append([convert_dms_to_dec(wp[0]),
+                               convert_dms_to_dec(wp[1])])
+                xy.append([np.nan, np.nan])
+            else:
+                xy.append([wp[0], wp[1]])
+            speed.append(wp[2] if len(wp) == 3 else np.nan)
+        n_waypoints.append(len(v['waypoints']))
+    xy = np.array(xy, dtype=float)
+
+    utm_zone = geometry['utm_zone']
+    south = False
+    if latlon:
+        # Project all of the DMS waypoints at once. pyproj is only imported
+        # when there are any
+        import pyproj
+        lat, lon = np.array(latlon).T
+        zone, south = get_utm_zone(lon, lat)
+        if utm_zone is None:
+            utm_zone = zone
+        p = pyproj.Proj(proj='utm',
+                        zone=utm_zone,
+                        south=south,
+                        ellps='WGS84',
+                        preserve_units=False)
+        is_dms = np.isnan(xy[:, 0])
+        xy[is_dms, 0], xy[is_dms, 1] = p(lon, lat)
+    xys = np.concatenate([xy, np.array(speed, dtype=float)[:, None]], axis=1)
+    waypoints = np.split(xys, np.cumsum(n_waypoints)[:-1])
+
+    _add_to_cache(_projection_cache, key, (waypoints, utm_zone, south))
+    return waypoints, utm_zone, south
+
+
+def _get_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"scenario_{key}.npz")
+
+
+def _load_compiled(cache_dir, key):
+    path = _get_cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as f:
+            if int(f['version']) != CACHE_VERSION or str(f['key']) != key:
+                return None
+            conf = json.loads(str(f['conf']))
+            waypoints = np.split(f['waypoints'],
+                                 np.cumsum(f['n_waypoints'])[:-1])
+            return CompiledScenario(conf=conf,
+                                    key=key,
+                                    vessel_ids=[str(v) for v
+                                                in f['vessel_ids']],
+                                    speed_mps=f['speed_mps'],
+                                    waypoints=waypoints,
+                                    xy_lim=f['xy_lim'].tolist(),
+                                    utm_zone=int(f['utm_zone'])
+                                    if f['utm_zone'] >= 0 else None,
+                                    south=bool(f['south']))
+    except (OSError, ValueError, KeyError):
+        # A damaged cache file is recompiled
+        return None
+
+
+def _save_compiled(cache_dir, compiled):
+    path = _get_cache_path(cache_dir, compiled.key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so other processes never see a
+        # partly written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f,
+                     version=CACHE_VERSION,
+                     key=compiled.key,
+                     conf=json.dumps(compiled.conf),
+                     vessel_ids=np.array(compiled.vessel_ids, dtype=str),
+                     speed_mps=compiled.speed_mps,
+                     waypoints=np.concatenate(compiled.waypoints),
+                     n_waypoints=[len(wp) for wp in compiled.waypoints],
+                     xy_lim=compiled.xy_lim,
+                     utm_zone=-1 if compiled.utm_zone is None
+                     else compiled.utm_zone,
+                     south=compiled.south)
+        os.replace(tmp_path, path)
+    except OSError:
+        # The cache is only an optimisation
+        pass
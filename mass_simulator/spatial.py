@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def find_neighbour_pairs(xy,
+                         radius):
+    """Find every ordered pair (i, j), i != j, of the points xy with shape
+    (N, 2) that are within radius of each other. The points are binned into a
+    uniform grid with cells of size radius so only the neighbouring cells of
+    each point need to be searched. The pairs are returned sorted by i then j"""
+    xy = np.asarray(xy)
+    N = len(xy)
+    if N < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Integer cell coordinates with a border of one empty cell so the
+    # neighbouring cells never wrap around
+    cell = np.floor(xy/radius).astype(np.int64)
+    cell -= cell.min(axis=0) - 1
+    n_y = cell[:, 1].max() + 2
+    key = cell[:, 0]*n_y + cell[:, 1]
+
+    order = np.argsort(key, kind='stable')
+    key_sorted = key[order]
+
+    pairs_i = []
+    pairs_j = []
+    for off_x in [-1, 0, 1]:
+        for off_y in [-1, 0, 1]:
+            key_n = key + off_x*n_y + off_y
+            start = np.searchsorted(key_sorted, key_n, side='left')
+            end = np.searchsorted(key_sorted, key_n, side='right')
+            counts = end - start
+            n_pairs = counts.sum()
+            if n_pairs == 0:
+                continue
+            # Expand every point against the points in the neighbouring cell
+            i = np.repeat(np.arange(N), counts)
+            offset = np.arange(n_pairs) - np.repeat(np.cumsum(counts)-counts,
+                                                    counts)
+            j = order[np.repeat(start, counts) + offset]
+            pairs_i.append(i)
+            pairs_j.append(j)
+
+    if not pairs_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+
+    # Only keep the pairs which are actually within range
+    d_sq = ((xy[i] - xy[j])**2).sum(axis=1)
+    keep = (i != j) & (d_sq <= radius**2)
+    i = i[keep]
+    j = j[keep]
+
+    order = np.lexsort((j, i))
+    return i[order], j[order]
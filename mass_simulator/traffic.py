@@ -0,0 +1,163 @@
+import json
+import argparse
+import numpy as np
+
+# Default centre, in UTM zone 30 near the bundled scenarios off Plymouth
+CENTRE_XY = (430_000., 5_555_000.)
+
+PATTERNS = ['crossing', 'head_on', 'overtaking', 'port_approach']
+
+
+def generate_scenario(n_vessels: int,
+                      seed: int = 0,
+                      patterns: dict = None,
+                      centre_xy: tuple = CENTRE_XY,
+                      utm_zone: int = 30,
+                      radius_m: float = 20_000.,
+                      lane_width_m: float = 2_000.,
+                      speed_kn: tuple = (6., 22.),
+                      t_step: float = 1.):
+    """Return a scenario dictionary of n_vessels vessels in traffic patterns
+    around centre_xy, with the waypoints in UTM. The same seed always gives
+    the same scenario.
+
+    patterns gives the share of the vessels in each pattern, and defaults to
+    an equal share of each:
+        'crossing': two lanes crossing at 60 to 120 degrees, with traffic in
+                    both directions keeping to the starboard side
+        'head_on': a lane with traffic in both directions on the centre line
+        'overtaking': a lane with traffic in one direction at mixed speeds
+        'port_approach': vessels arriving at and leaving a port near the edge
+                         of the area through an approach waypoint
+    The first vessel is the 'agent' and follows the first crossing lane
+    through the centre. Vessels start up to halfway along their track, so
+    the whole area has traffic from the start. t_max is set to the time the
+    slowest vessel takes to finish.
+    """
+    if n_vessels < 1:
+        raise ValueError("n_vessels must be at least 1.")
+    if patterns is None:
+        patterns = {p: 1. for p in PATTERNS}
+    for p in patterns:
+        if p not in PATTERNS:
+            raise ValueError(f"Unknown traffic pattern {p}. " +
+                             f"Must be one of {PATTERNS}.")
+    weights = np.array([patterns[p] for p in patterns], dtype=float)
+    if not np.all(np.isfinite(weights)) or np.any(weights < 0) or \
+            weights.sum() <= 0:
+        raise ValueError("Traffic pattern shares must be finite, not " +
+                         "negative and not all zero.")
+    rng = np.random.default_rng(seed)
+
+    # The layout of the lanes and port is also set by the seed
+    angle_crossing = rng.uniform(0, 180)
+    angles = {'crossing': [angle_crossing,
+                           angle_crossing + rng.uniform(60, 120)],
+              'head_on': rng.uniform(0, 180),
+              'overtaking': rng.uniform(0, 180)}
+    port_bearing = rng.uniform(0, 360)
+
+    counts = rng.multinomial(n_vessels-1, weights/weights.sum())
+
+    vessel_ids = ['agent']
+    tracks = [_lane_tracks(angles['crossing'][0], radius_m,
+                           offset=np.array([0.3*lane_width_m]),
+                           start_frac=np.zeros(1),
+                           direction=np.ones(1))]
+    speeds = [np.array([12.])]
+    for p, n in zip(patterns, counts):
+        if n == 0:
+            continue
+        direction = rng.choice([-1., 1.], n)
+        start_frac = rng.uniform(0, 0.5, n)
+        if p == 'crossing':
+            lane = rng.integers(0, 2, n)
+            offset = rng.uniform(0.1, 0.5, n)*lane_width_m
+            xy = [_lane_tracks(angles['crossing'][i], radius_m, offset,
+                               start_frac, direction) for i in [0, 1]]
+            xy = np.where(lane[:, None, None] == 0, xy[0], xy[1])
+        elif p == 'head_on':
+            offset = rng.normal(0, 0.1*lane_width_m, n)
+            xy = _lane_tracks(angles['head_on'], radius_m, offset,
+                              start_frac, direction)
+        elif p == 'overtaking':
+            offset = rng.normal(0, 0.1*lane_width_m, n)
+            xy = _lane_tracks(angles['overtaking'], radius_m, offset,
+                              start_frac, np.ones(n))
+        else:
+            xy = _port_tracks(rng, port_bearing, radius_m, lane_width_m,
+                              start_frac, direction)
+        tracks.append(xy)
+        speeds.append(rng.uniform(speed_kn[0], speed_kn[1], n))
+        vessel_ids += [f"{p}{i}" for i in range(n)]
+
+    # Tracks of different patterns can have different numbers of waypoints
+    waypoints = [wp for xy in tracks
+                 for wp in (xy + np.asarray(centre_xy)).round(1).tolist()]
+    lengths = np.concatenate([np.linalg.norm(np.diff(xy, axis=1),
+                                             axis=2).sum(axis=1)
+                              for xy in tracks])
+    speeds = np.concatenate(speeds).round(2)
+    t_max = np.ceil((lengths/(0.5144*speeds)).max()/t_step)*t_step
+
+    vessel_details = []
+    for vessel_id, speed, wps in zip(vessel_ids, speeds.tolist(), waypoints):
+        vessel_details.append({'vessel': vessel_id,
+                               'speed_kn': speed,
+                               'waypoints': wps})
+    return {'params': {'t_step': t_step,
+                       't_max': float(t_max),
+                       'utm_zone': utm_zone},
+            'vessel_details': vessel_details}
+
+
+def _lane_tracks(angle_deg, radius_m, offset, start_frac, direction):
+    # Tracks along a lane through the origin at angle_deg from north, which
+    # start start_frac of the way along and are offset to starboard of the
+    # direction of travel. Returns shape (n, 2, 2)
+    along = np.array([np.sin(np.deg2rad(angle_deg)),
+                      np.cos(np.deg2rad(angle_deg))])
+    starboard = np.array([along[1], -along[0]])
+    d = direction[:, None]
+    side = (offset[:, None]*d)*starboard
+    start = ((2*start_frac - 1)*radius_m)[:, None]*d*along + side
+    end = radius_m*d*along + side
+    return np.stack([start, end], axis=1)
+
+
+def _port_tracks(rng, port_bearing, radius_m, lane_width_m, start_frac,
+                 direction):
+    # Arrivals come from the far side of the area through an approach
+    # waypoint to a berth in the port, and departures leave the same way.
+    # Returns shape (n, 3, 2)
+    n = len(direction)
+    b = np.deg2rad(port_bearing)
+    port = 0.8*radius_m*np.array([np.sin(b), np.cos(b)])
+    berth = port + rng.normal(0, 0.2*lane_width_m, (n, 2))
+    approach = 0.6*port + rng.normal(0, 0.2*lane_width_m, (n, 2))
+    b_sea = b + np.pi + rng.uniform(-np.pi/3, np.pi/3, n)
+    sea = radius_m*np.stack([np.sin(b_sea), np.cos(b_sea)], axis=1)
+    # Arrivals start part of the way in from sea, and departures part of the
+    # way out to the approach waypoint
+    arriving = (direction > 0)[:, None]
+    start = np.where(arriving,
+                     sea + start_frac[:, None]*(approach - sea),
+                     berth + 2*start_frac[:, None]*(approach - berth))
+    return np.where(arriving[:, None],
+                    np.stack([start, approach, berth], axis=1),
+                    np.stack([start, approach, sea], axis=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a seeded traffic scenario")
+    parser.add_argument('n_vessels', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default="scenarios/traffic.json")
+    args = parser.parse_args()
+    with open(args.out, 'w') as f:
+        json.dump(generate_scenario(args.n_vessels, seed=args.seed), f)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,19 @@ class World():
     def __init__(self,
                  t_step):
         self.t_step = t_step
+        self.n = 0
         self.t_elapsed = 0
 
     def next_step(self):
-        self.t_elapsed += self.t_step
+        self.n += 1
+        self.t_elapsed = self.n*self.t_step
+
+    def advance(self, n_steps):
+        # The time comes from the step count rather than adding up t_step, so
+        # it's the same however many steps are taken at once
+        self.n += n_steps
+        self.t_elapsed = self.n*self.t_step
 
     def set_t(self, t):
+        self.n = round(t/self.t_step)
         self.t_elapsed = t